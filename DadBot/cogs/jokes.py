@@ -1,51 +1,278 @@
+import asyncio
+import json
+import os
 import re
 import discord
+from dataclasses import dataclass, field
 from discord.ext import commands
+from functools import lru_cache
+from pathlib import Path
 import random
+from DadBot.cooldowns import CooldownStore
+from DadBot.pipeline import MessageState, pipeline_for
+from DadBot.log import get_logger
+from DadBot.metrics import registry, track_call
+
+log = get_logger("messages")
+
+JOKES_FILE = "jokes.json"
+JOKES_PATH = Path(__file__).resolve().parent.parent.parent / JOKES_FILE
+
+MAX_TRIGGERS = 25
+MAX_PHRASE = 50
+MAX_RESPONSE = 200
+MAX_WHO = 60
+
+# The built-in "I'm ..." joke, which every guild has unless it removes it
+DAD_PHRASE = "i'm"
+# Patterns run on the lowercased message, and a word boundary before a phrase is checked
+# right after its first letter, "i(?<!\w.)" rather than "\bi". That way every alternative
+# starts with a literal and the regex engine skips ahead to the letters that can start one.
+_AFTER_BOUNDARY = r"(?<!\w.)"
+_DAD_HEAD = r"i" + _AFTER_BOUNDARY + r"\s*(?:(?:['’]?\s*m)|a\s*m)\s+"
+
+# Punctuation becomes whitespace when comparing phrases
+_SPACES = str.maketrans({c: " " for c in "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~‘’“”«»¿¡…–—"})
+
+def _words(text: str) -> list[str]:
+    return text.lower().translate(_SPACES).split()
+
+@dataclass(frozen=True, slots=True)
+class Trigger:
+    """A phrase to listen for, and what to answer. The response can use {rest}, the text
+    after the phrase, and {name}, the author's name. The built-in has no response."""
+    phrase: str
+    response: str | None = None
+
+    @property
+    def builtin(self) -> bool:
+        return self.response is None
+
+DAD_JOKE = Trigger(DAD_PHRASE)
+
+@lru_cache(maxsize=4096)
+def _head(phrase: str) -> str:
+    """Regex for a lowercased phrase as whole words, with any whitespace between them"""
+    words = [re.escape(word).replace("'", "['’]") for word in phrase.lower().split()]
+    head = r"\s+".join(words)
+    if re.match(r"\w", head):
+        head = head[0] + _AFTER_BOUNDARY + head[1:]
+    return head + (r"(?!\w)" if re.search(r"\w$", phrase) else "")
+
+def _fragment(trigger: Trigger, i: int) -> str:
+    # The rest of the message is group r<i>, the only group in each alternative; the
+    # built-in needs some, like it always has
+    if trigger.builtin:
+        return rf"{_DAD_HEAD}(?P<r{i}>.+?)[\s.!?]*$"
+    return rf"{_head(trigger.phrase)}(?P<r{i}>.*?)[\s.!?]*$"
+
+class Matcher:
+    """All of a guild's triggers compiled into one alternation, group r<i> for trigger i"""
+    __slots__ = ("triggers", "regex", "_regex_i")
+
+    def __init__(self, triggers: tuple[Trigger, ...]):
+        self.triggers = triggers
+        self.regex = re.compile("|".join(_fragment(t, i) for i, t in enumerate(triggers))) if triggers else None
+        self._regex_i: re.Pattern | None = None
+
+    def match(self, content: str) -> tuple[Trigger, str] | None:
+        """The first trigger in the message and the text after it"""
+        if self.regex is None:
+            return None
+        lowered = content.lower()
+        if len(lowered) == len(content):
+            m = self.regex.search(lowered)
+        else:
+            # A few characters lowercase to more than one, so offsets wouldn't line up
+            if self._regex_i is None:
+                self._regex_i = re.compile(self.regex.pattern, re.IGNORECASE)
+            m = self._regex_i.search(content)
+        if m is None:
+            return None
+        i = int(m.lastgroup[1:]) # type: ignore[index]
+        start, end = m.span(i + 1)
+        return self.triggers[i], content[start:end].strip()
+
+# Matchers are shared by guilds with the same triggers, e.g. every guild with just the built-in
+_matchers: dict[tuple[Trigger, ...], Matcher] = {}
+
+def matcher_for(triggers: tuple[Trigger, ...]) -> Matcher:
+    matcher = _matchers.get(triggers)
+    if matcher is None:
+        matcher = _matchers[triggers] = Matcher(triggers)
+    return matcher
+
+@dataclass(slots=True)
+class GuildJokes:
+    dad: bool = True
+    triggers: list[Trigger] = field(default_factory=list)
+
+    def all(self) -> tuple[Trigger, ...]:
+        # Earlier triggers win when several match at the same place, so the built-in goes last
+        return tuple(self.triggers) + ((DAD_JOKE,) if self.dad else ())
+
+    def to_dict(self) -> dict:
+        return {"dad": self.dad, "triggers": [{"phrase": t.phrase, "response": t.response} for t in self.triggers]}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "GuildJokes":
+        return cls(dad=d.get("dad", True), triggers=[Trigger(t["phrase"], t["response"]) for t in d.get("triggers", [])])
+
+def _validate(phrase: str, response: str) -> str | None:
+    if not _words(phrase):
+        return "The phrase needs at least one word."
+    if len(phrase) > MAX_PHRASE:
+        return f"The phrase can be at most {MAX_PHRASE} characters."
+    if len(response) > MAX_RESPONSE:
+        return f"The response can be at most {MAX_RESPONSE} characters."
+    return None
 
 class Jokes(commands.Cog):
     """Dad jokes"""
 
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, path: Path | None = JOKES_PATH):
         self.bot = bot
+        self.path = path
+        self.guilds: dict[int, GuildJokes] = {}
+        self._guild_matchers: dict[int, Matcher] = {}
+        # When the bot last joked in each channel, keyed by guild and channel
+        self.cooldowns = CooldownStore(ttl=int(os.getenv("DADBOT_JOKE_COOLDOWN", "30")), max_entries=50_000, path=None)
+        self._save_lock = asyncio.Lock()
+        registry.gauge("dadbot_joke_matchers", "Distinct compiled joke matchers", fn=lambda: len(_matchers))
+        registry.gauge("dadbot_joke_cooldowns", "Channels with a running joke cooldown", fn=lambda: len(self.cooldowns))
 
-    @commands.group(name='jokes', invoke_without_command=False)
+    @commands.group(name='jokes', invoke_without_command=True)
     @commands.has_guild_permissions(manage_guild=True)
     async def jokes(self, ctx):
         """Base jokes command"""
-        pass
+        await ctx.send(
+            "Joke commands:\n"
+            "• $jokes list\n"
+            "• $jokes add \"<phrase>\" <response>, the response can use {rest} and {name}\n"
+            "• $jokes remove <phrase>"
+        )
+
+    @jokes.command(name='list')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def list_jokes(self, ctx):
+        """List this server's joke triggers"""
+        triggers = self.jokes_for(ctx.guild.id).all()
+        if not triggers:
+            return await ctx.send("No joke triggers. Add one with $jokes add.")
+        lines = [f"• {t.phrase} → " + ("Hi <who>, I'm DadBot. (built in)" if t.builtin else t.response) for t in triggers] # type: ignore[operator]
+        await ctx.send("Joke triggers:\n" + "\n".join(lines), allowed_mentions=discord.AllowedMentions.none())
+
+    @jokes.command(name='add')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def add(self, ctx, phrase: str, *, response: str | None = None):
+        """Add a joke trigger, e.g. $jokes add "i'm hungry" Hi hungry, I'm DadBot. Add "i'm" with no response to bring back the built-in."""
+        guild_jokes = self.jokes_for(ctx.guild.id)
+        key = " ".join(_words(phrase))
+        if any(" ".join(_words(t.phrase)) == key for t in guild_jokes.all()):
+            return await ctx.send(f"\"{phrase}\" is already a trigger, remove it first.")
+        if response is None:
+            if key != " ".join(_words(DAD_PHRASE)):
+                return await ctx.send("Give a response too, e.g. $jokes add \"i'm hungry\" Hi {rest}, I'm DadBot.")
+            guild_jokes.dad = True
+        else:
+            err = _validate(phrase, response)
+            if err: return await ctx.send(err)
+            if len(guild_jokes.triggers) >= MAX_TRIGGERS:
+                return await ctx.send(f"A server can have at most {MAX_TRIGGERS} joke triggers.")
+            guild_jokes.triggers.append(Trigger(phrase.strip(), response))
+        await self._changed(ctx.guild.id)
+        await ctx.send(f"Added the joke trigger \"{phrase}\".", allowed_mentions=discord.AllowedMentions.none())
+
+    @jokes.command(name='remove')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def remove(self, ctx, *, phrase: str):
+        """Remove a joke trigger, "i'm" removes the built-in"""
+        guild_jokes = self.jokes_for(ctx.guild.id)
+        key = " ".join(_words(phrase))
+        kept = [t for t in guild_jokes.triggers if " ".join(_words(t.phrase)) != key]
+        if len(kept) < len(guild_jokes.triggers):
+            guild_jokes.triggers = kept
+        elif guild_jokes.dad and key == " ".join(_words(DAD_PHRASE)):
+            guild_jokes.dad = False
+        else:
+            return await ctx.send(f"\"{phrase}\" isn't a joke trigger.", allowed_mentions=discord.AllowedMentions.none())
+        await self._changed(ctx.guild.id)
+        await ctx.send(f"Removed the joke trigger \"{phrase}\".", allowed_mentions=discord.AllowedMentions.none())
+
+    def jokes_for(self, guild_id: int) -> GuildJokes:
+        guild_jokes = self.guilds.get(guild_id)
+        if guild_jokes is None:
+            guild_jokes = self.guilds[guild_id] = GuildJokes()
+        return guild_jokes
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or message.author == self.bot.user or message.guild is None:
+    def matcher(self, guild_id: int) -> Matcher:
+        matcher = self._guild_matchers.get(guild_id)
+        if matcher is None:
+            guild_jokes = self.guilds.get(guild_id)
+            matcher = self._guild_matchers[guild_id] = matcher_for(guild_jokes.all() if guild_jokes else (DAD_JOKE,))
+        return matcher
+
+    async def _changed(self, guild_id: int) -> None:
+        # Only this guild's matcher is rebuilt, other guilds keep theirs
+        self._guild_matchers.pop(guild_id, None)
+        self.matcher(guild_id)
+        await self.save()
+
+    def _read(self) -> dict[int, GuildJokes]:
+        if self.path is None or not self.path.exists():
+            return {}
+        with self.path.open("r", encoding="utf-8") as file:
+            data = json.load(file)
+        return {int(guild_id): GuildJokes.from_dict(d) for guild_id, d in data.get("guilds", {}).items()}
+
+    def _write(self, data: dict) -> None:
+        assert self.path is not None
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp.open("w", encoding="utf-8") as file:
+            json.dump(data, file, indent=2)
+        os.replace(tmp, self.path)
+
+    async def save(self) -> None:
+        if self.path is None:
             return
-        
-        message_template = re.compile(
-            r"""(?ix)
-            \b
-            i \s* (?: (?:['’]?\s*m) |a \s* m)
-            \s+
-            (?P<who> .+? )
-            [\s\.\!\?]* $
-            """
-        )
-        m = message_template.search(message.content or "")
-        if m:
-            who = m.group("who").strip()
+        data = {"guilds": {str(guild_id): g.to_dict() for guild_id, g in self.guilds.items() if g != GuildJokes()}}
+        async with self._save_lock:
+            await asyncio.to_thread(self._write, data)
 
-            if len(who) > 60:
-                who = who[:60] + "..."
+    async def cog_load(self):
+        try:
+            self.guilds = await asyncio.to_thread(self._read)
+        except (OSError, ValueError, KeyError, TypeError):
+            log.exception("Could not read %s, starting with the built-in jokes only", self.path)
+        self._guild_matchers.clear()
+        pipeline_for(self.bot).add_stage("jokes", self.tell_joke, order=200)
 
-            allowed = discord.AllowedMentions.none()
-            num_words = len(who.split())
-            if num_words <= 1:
-                await message.channel.send(f"Hi {who}, I'm DadBot.", allowed_mentions=allowed)
-            elif num_words <= 2 and random.random() < 0.5: 
-                await message.channel.send(f"Hi {who}, I'm DadBot.", allowed_mentions=allowed)
-            elif num_words <= 3 and random.random() < 0.33:
-                await message.channel.send(f"Hi {who}, I'm DadBot.", allowed_mentions=allowed)
+    async def cog_unload(self):
+        pipeline_for(self.bot).remove_stage("jokes")
+
+    async def tell_joke(self, state: MessageState) -> None:
+        """Message pipeline stage"""
+        message = state.message
+        found = self.matcher(message.guild.id).match(message.content or "") # type: ignore[union-attr]
+        if found is None or self.cooldowns.in_cooldown(message.guild.id, message.channel.id): # type: ignore[union-attr]
+            return
+        trigger, who = found
+        if len(who) > MAX_WHO:
+            who = who[:MAX_WHO] + "..."
 
-        await self.bot.process_commands(message)
+        if trigger.builtin:
+            num_words = len(who.split())
+            if not (num_words <= 1
+                    or (num_words <= 2 and random.random() < 0.5)
+                    or (num_words <= 3 and random.random() < 0.33)):
+                return
+            reply = f"Hi {who}, I'm DadBot."
+        else:
+            if not who and "{rest}" in trigger.response: # type: ignore[operator]
+                return
+            reply = trigger.response.replace("{rest}", who).replace("{name}", message.author.display_name) # type: ignore[union-attr]
+        self.cooldowns.touch(message.guild.id, message.channel.id) # type: ignore[union-attr]
+        await track_call("send", message.channel.send(reply, allowed_mentions=discord.AllowedMentions.none()))
 
 async def setup(bot: commands.Bot):
-    await bot.add_cog(Jokes(bot))
\ No newline at end of file
+    await bot.add_cog(Jokes(bot))
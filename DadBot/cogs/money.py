@@ -1,22 +1,129 @@
+import asyncio
 import discord
-import sqlite3
-from discord.ext import commands
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from discord.ext import commands, tasks
+from DadBot.ledger import MAX_AMOUNT, Ledger, format_amount
+from DadBot.log import get_logger
+from DadBot.metrics import registry
+
+log = get_logger("money")
+
+def _parse_amount(amount: str) -> int | None:
+    """Dollars as typed ("5", "2.50", "$1,000") to cents, or None if it isn't a positive amount up to MAX_AMOUNT"""
+    try:
+        value = Decimal(amount.replace("$", "").replace(",", ""))
+    except InvalidOperation:
+        return None
+    if not value.is_finite() or value <= 0 or value * 100 > MAX_AMOUNT or value != value.quantize(Decimal("0.01")):
+        return None
+    return int(value * 100)
+
+def payout_period(today: date | None = None) -> str:
+    """Allowance is weekly, so the period is the ISO week, e.g. 2026-W42"""
+    year, week, _ = (today or date.today()).isocalendar()
+    return f"{year}-W{week:02d}"
 
 class Money(commands.Cog):
     """Allowance"""
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.ledger = Ledger()
+        registry.counter("dadbot_ledger_batches_total", "Ledger write batches committed", fn=lambda: self.ledger.write_stats["batches"])
+        registry.counter("dadbot_ledger_rows_total", "Ledger changes committed", fn=lambda: self.ledger.write_stats["rows"])
+        registry.counter("dadbot_ledger_write_seconds_total", "Time spent committing ledger batches", fn=lambda: self.ledger.write_stats["seconds"])
+
+    async def cog_load(self):
+        self.payouts.start()
+
+    async def cog_unload(self):
+        self.payouts.cancel()
+        await asyncio.to_thread(self.ledger.close)
+
+    async def pay_guild(self, guild: discord.Guild, role_id: int, amount: int, period: str) -> int | None:
+        """Pays one payout rule for a guild, once per period"""
+        if await self.ledger.is_paid(guild.id, role_id, period):
+            return None
+        # Requested without caching, so a lean member cache stays lean
+        members = await guild.chunk(cache=False)
+        user_ids = [m.id for m in members if not m.bot and (not role_id or m.get_role(role_id) is not None)]
+        paid = await self.ledger.pay_out(guild.id, role_id, period, amount, user_ids)
+        if paid is not None:
+            log.info("Paid %s allowance to %d members in %s for %s", format_amount(amount), paid, guild, period)
+        return paid
+
+    @tasks.loop(hours=1)
+    async def payouts(self):
+        # Pays on the first run of each week, a restart in the same week finds it already paid
+        period = payout_period()
+        for guild_id, role_id, amount in await self.ledger.payout_rules():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue # Not in this shard
+            try:
+                await self.pay_guild(guild, role_id, amount, period)
+            except Exception:
+                log.exception("Allowance payout failed in %s", guild)
+
+    @payouts.before_loop
+    async def before_payouts(self):
+        await self.bot.wait_until_ready()
+
+    @commands.group(name='allowance', invoke_without_command=True)
+    @commands.has_guild_permissions(manage_guild=True)
+    async def allowance(self, ctx, member: discord.Member, amount: str):
+        """Give a member allowance, e.g. $allowance @Kid 5.00"""
+        cents = _parse_amount(amount)
+        if cents is None:
+            return await ctx.send(f"Amount must be a positive number of dollars up to {format_amount(MAX_AMOUNT)}, like 5 or 2.50")
+        self.ledger.add(ctx.guild.id, member.id, cents, reason=f"allowance from {ctx.author.id}")
+        balance = await self.ledger.balance(ctx.guild.id, member.id)
+        log.info("%s gave %s %s in %s", ctx.author, member, format_amount(cents), ctx.guild)
+        await ctx.send(f"Gave {member.display_name} {format_amount(cents)}. Their balance is now {format_amount(balance)}.")
+
+    @allowance.command(name='weekly')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def weekly(self, ctx, amount: str | None = None, role: discord.Role | None = None):
+        """Set a weekly allowance for everyone or a role, e.g. $allowance weekly 5 @Kids. Use "off" to stop it."""
+        role_id = role.id if role is not None else 0
+        target = role.name if role is not None else "everyone"
+        if amount is None:
+            rules = await self.ledger.payout_rules(ctx.guild.id)
+            if not rules:
+                return await ctx.send("No weekly allowance is set.")
+            lines = [f"• {'everyone' if r == 0 else getattr(ctx.guild.get_role(r), 'name', r)}: {format_amount(a)}" for _, r, a in rules]
+            return await ctx.send("Weekly allowance:\n" + "\n".join(lines))
+        if amount.lower() == "off":
+            await self.ledger.set_payout_rule(ctx.guild.id, role_id, None)
+            return await ctx.send(f"Stopped the weekly allowance for {target}.")
+        cents = _parse_amount(amount)
+        if cents is None:
+            return await ctx.send(f"Amount must be a positive number of dollars up to {format_amount(MAX_AMOUNT)}, like 5 or 2.50")
+        await self.ledger.set_payout_rule(ctx.guild.id, role_id, cents)
+        paid = await self.pay_guild(ctx.guild, role_id, cents, payout_period())
+        await ctx.send(f"Weekly allowance for {target} set to {format_amount(cents)}."
+                       + (f" Paid {paid} members for this week." if paid else ""))
 
-    @commands.command(name='allowance')
-    async def allowance(self, ctx):
-        #give allowance amount
-        pass
+    @commands.command(name='leaderboard')
+    async def leaderboard(self, ctx, count: int = 10):
+        """Show the largest balances"""
+        count = max(1, min(count, 25))
+        top = await self.ledger.top(ctx.guild.id, count)
+        if not top:
+            return await ctx.send("Nobody has any allowance yet.")
+        lines = []
+        for rank, (user_id, balance) in enumerate(top, 1):
+            member = ctx.guild.get_member(user_id)
+            lines.append(f"{rank}. {member.display_name if member else user_id}: {format_amount(balance)}")
+        await ctx.send("Leaderboard:\n" + "\n".join(lines))
 
     @commands.command(name='balance')
-    async def balance(self, ctx):
-        #check balance
-        pass
+    async def balance(self, ctx, member: discord.Member | None = None):
+        """Check your balance, or someone else's"""
+        member = member or ctx.author
+        balance = await self.ledger.balance(ctx.guild.id, member.id)
+        await ctx.send(f"{member.display_name} has {format_amount(balance)}.")
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(Money(bot))
@@ -1,8 +1,22 @@
 import discord
-from discord.ext import commands
-from datetime import time, date, datetime, timedelta
-from DadBot.config_manager import get_server_config, set_server_config
+from discord.ext import commands, tasks
+from datetime import time, date
+import io
+from DadBot.config_manager import get_server_config, set_server_config, load_root, replace_guild
+from DadBot.config_models import GuildConfig
+from DadBot.config_transfer import diff_guilds, export_guild, parse_import
 from DadBot.logic import is_quiet_time
+from DadBot.pipeline import MessageState, pipeline_for
+from DadBot.cooldowns import CooldownStore, cooldown_path
+from DadBot.outbox import DMOutbox
+from DadBot.deletions import DeletionBuffer
+from DadBot.log import get_logger
+from DadBot.metrics import registry, summary, timed, track_call
+from DadBot.profiling import is_profiling, profile_for
+from DadBot.members import MemberResolver, guild_memory, process_rss
+
+log = get_logger("messages")
+traffic_log = get_logger("traffic")
 
 def _is_valid_time(hour: int, minute: int) -> str | None:
     if hour > 23 or hour < 0:
@@ -11,12 +25,66 @@ def _is_valid_time(hour: int, minute: int) -> str | None:
         return "The minute must be between 0 and 59 inclusive."
     return None
 
+MAX_IMPORT_BYTES = 2 * 1024 * 1024
+
+def _truncated(lines: list[str], limit: int = 1800) -> str:
+    """Joins lines up to about `limit` characters, noting how many were left out"""
+    out: list[str] = []
+    size = 0
+    for i, line in enumerate(lines):
+        if size + len(line) > limit:
+            out.append(f"... and {len(lines) - i} more")
+            break
+        out.append(line)
+        size += len(line) + 1
+    return "\n".join(out)
+
 class Parental(commands.Cog):
     """Server-wide quiet-time configuration"""
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.last_message = {}
+        self.cooldowns: dict[int, CooldownStore] = {} # Per shard, a guild only ever lives on one
+        registry.gauge("dadbot_cooldown_entries", "Members with a running quiet time cooldown",
+                       fn=lambda: sum(len(store) for store in self.cooldowns.values()))
+        self.outbox = DMOutbox()
+        registry.gauge("dadbot_dm_outbox_queued", "Direct messages waiting to be sent", fn=lambda: len(self.outbox))
+        self.deletions = DeletionBuffer(on_forbidden=self._cannot_delete)
+        registry.gauge("dadbot_delete_buffered", "Messages waiting to be deleted", fn=lambda: len(self.deletions))
+        self.members = MemberResolver()
+        registry.gauge("dadbot_fetched_members", "Members kept by the lazy role cache", fn=lambda: len(self.members))
+        registry.counter("dadbot_member_fetches_total", "Members fetched because they weren't cached", fn=lambda: self.members.stats["fetches"])
+
+    def cooldowns_for(self, guild: discord.Guild) -> CooldownStore:
+        """Cooldown store of the guild's shard, restored from its snapshot on first use"""
+        shard_id = guild.shard_id or 0
+        store = self.cooldowns.get(shard_id)
+        if store is None:
+            sharded = self.bot.shard_count is not None and self.bot.shard_count > 1
+            store = self.cooldowns[shard_id] = CooldownStore(path=cooldown_path(shard_id if sharded else None))
+            restored = store.restore()
+            if restored:
+                log.info("Restored %d quiet time cooldowns for shard %d", restored, shard_id)
+        return store
+
+    async def cog_load(self):
+        self.outbox.start()
+        self.sweep_cooldowns.start()
+        pipeline_for(self.bot).add_stage("quiet_time", self.enforce_quiet_time, order=100)
+
+    async def cog_unload(self):
+        pipeline_for(self.bot).remove_stage("quiet_time")
+        self.sweep_cooldowns.cancel()
+        await self.deletions.flush()
+        await self.outbox.stop()
+        for store in self.cooldowns.values():
+            await store.save()
+
+    @tasks.loop(minutes=5)
+    async def sweep_cooldowns(self):
+        for store in list(self.cooldowns.values()):
+            store.sweep()
+            await store.save()
 
     @commands.group(name='parental', invoke_without_command=True)
     @commands.has_guild_permissions(manage_guild=True)
@@ -24,7 +92,7 @@ class Parental(commands.Cog):
         """Base parental command"""
         guild_id = ctx.guild.id
         server_config = get_server_config(guild_id)
-        await ctx.send("Use subcommands: start, end, days, grace, reset, override")
+        await ctx.send("Use subcommands: start, end, days, grace, reset, override, export, import")
         await ctx.send(
             f"Current server quiet config:\n"
             f"• start: {server_config.start_time}\n"
@@ -138,60 +206,124 @@ class Parental(commands.Cog):
         set_server_config(guild_id, holidays=holidays)
         raise NotImplementedError
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or message.author == self.bot.user or message.guild is None:
-            return
-        
-        ctx = await self.bot.get_context(message)
-        if ctx.guild is not None:
-            guild_id: int = ctx.guild.id
-
-            # if is_quiet_time(guild_id=guild_id, member=message.author) and not ctx.valid: # type: ignore
-            #     try:
-            #         await message.delete()
-            #     except discord.Forbidden:
-            #         try:
-            #             print("No permission to delete messages.")
-            #             await ctx.send("No permission to delete messages.")
-            #         except discord.Forbidden:
-            #             print("No permission to send or delete messages.")
-
-            if is_quiet_time(guild_id=guild_id, member=message.author) and not ctx.valid: # type: ignore
-                try:
-                    last_time = self.last_message.get(guild_id, {}).get(message.author.id, None) # Get time of last message
-                    if last_time is not None and datetime.now() < (last_time + timedelta(minutes=30)): # Check if it's been less than 30 minutes
-                        await message.delete()
-                        try: 
-                            await message.author.send(f"""{message.author}, it's been less than 30 minutes since your last message. Since it is quiet time, your message has been deleted. Here is your message in case you need to resend it at a later time:\n\n{message.content}""")
-                        except:
-                            print(f"No permission to send DM to {message.author}")
-                        print(f"Deleted message from {message.author}, since it's been less than 30 minutes since their last message.")
-                    else:
-                        self.last_message.setdefault(guild_id, {})[message.author.id] = datetime.now() # Update Last Message Time
-                except discord.Forbidden:
-                    try:
-                        print("No permission to delete messages.")
-                        await ctx.send("No permission to delete messages.")
-                    except discord.Forbidden:
-                        print("No permission to send or delete messages.")
-
-        print(f'Message in {message.guild}, #{message.channel} from {message.author}: {message.content}')
-        await self.bot.process_commands(message)
+    @parental.command(name='export')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def export(self, ctx):
+        """Export this server's quiet time config and overrides as a file"""
+        config = load_root().get_guild(ctx.guild.id) or GuildConfig(server_id=ctx.guild.id)
+        overrides = len(config.overrides.users) + len(config.overrides.roles)
+        await ctx.send(f"Quiet time config with {overrides} overrides. Edit it and send it back with `$parental import`.",
+                       file=discord.File(io.BytesIO(export_guild(config)), filename=f"dadbot-{ctx.guild.id}.json"))
+
+    @parental.command(name='import')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def import_config(self, ctx, mode: str | None = None):
+        """Replace this server's config and overrides with an attached export. Use "import dry_run" to only see the changes."""
+        dry_run = mode is not None and mode.lower() in ("dry_run", "dry-run", "dry", "diff")
+        if mode is not None and not dry_run:
+            return await ctx.send("Use `$parental import`, or `$parental import dry_run` to only see the changes, with the file attached.")
+        if not ctx.message.attachments:
+            return await ctx.send("Attach a file made by `$parental export`.")
+        attachment = ctx.message.attachments[0]
+        if attachment.size > MAX_IMPORT_BYTES:
+            return await ctx.send(f"That file is too large, the limit is {MAX_IMPORT_BYTES // 1024 // 1024} MiB.")
+
+        config, errors = parse_import(await attachment.read(), ctx.guild.id)
+        if config is None:
+            return await ctx.send(f"Nothing was imported, {len(errors)} problems:\n" + _truncated(errors))
+
+        def label(kind: str, target_id: int) -> str:
+            found = ctx.guild.get_role(target_id) if kind == "role" else ctx.guild.get_member(target_id)
+            return f"{kind} {getattr(found, 'name', None) or target_id}"
+
+        current = load_root().get_guild(ctx.guild.id) or GuildConfig(server_id=ctx.guild.id)
+        changes = diff_guilds(current, config, label)
+        if not changes:
+            return await ctx.send("The file matches the current config, nothing to change.")
+        if dry_run:
+            return await ctx.send(f"Dry run, {len(changes)} changes would be made:\n" + _truncated(changes))
+        replace_guild(ctx.guild.id, config)
+        log.info("%s imported a config with %d changes in %s", ctx.author, len(changes), ctx.guild)
+        await ctx.send(f"Imported, {len(changes)} changes:\n" + _truncated(changes))
+
+    @parental.command(name='stats')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def stats(self, ctx):
+        """Show handler latency, Discord API call and cache statistics"""
+        await ctx.send("Bot stats:\n" + "\n".join(summary()))
+
+    @parental.command(name='memory')
+    @commands.has_guild_permissions(manage_guild=True)
+    async def memory(self, ctx):
+        """Show what the bot keeps in memory for this server"""
+        usage = guild_memory(ctx.guild)
+        cached = sum(len(g.members) for g in self.bot.guilds)
+        await ctx.send(
+            f"Memory for this server:\n"
+            f"• cached members: {usage['members']} of {usage['member_count']} (~{usage['member_bytes'] / 1024:.0f} KiB)\n"
+            f"• roles: {usage['roles']}, channels: {usage['channels']}\n"
+            f"Bot process: {process_rss() / 2**20:.1f} MiB across {len(self.bot.guilds)} servers, "
+            f"{cached} cached members, {len(self.members)} fetched members"
+        )
+
+    @parental.command(name='profile')
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: int = 30):
+        """Profile the bot for a number of seconds and post a summary. Bot owners only, it slows down every server."""
+        if not 1 <= seconds <= 300:
+            return await ctx.send("Profile for between 1 and 300 seconds.")
+        if is_profiling():
+            return await ctx.send("A profile is already running.")
+        await ctx.send(f"Profiling for {seconds} seconds...")
+        report = await profile_for(seconds)
+        text = "\n".join(report.summary)
+        if len(text) > 1900:
+            text = text[:1900] + "\n..."
+        await ctx.send(f"```\n{text}\n```Full results in {report.stats_path.name} and {report.report_path.name}")
+
+    async def enforce_quiet_time(self, state: MessageState) -> bool:
+        """Message pipeline stage. Deletes repeat messages sent during quiet time."""
+        message = state.message
+        guild_id: int = message.guild.id # type: ignore
+
+        traffic_log.info("Message in %s, #%s from %s (%d chars)", message.guild, message.channel, message.author, len(message.content or ""))
+
+        if is_quiet_time(guild_id=guild_id, member=message.author) and not state.is_command: # type: ignore
+            cooldowns = self.cooldowns_for(message.guild) # type: ignore
+            if cooldowns.in_cooldown(guild_id, message.author.id): # Check if it's been less than 30 minutes
+                def deleted():
+                    # Back-to-back deletions are merged into one DM while it waits to be sent
+                    self.outbox.send(message.author, f"""{message.author}, it's been less than 30 minutes since your last message. Since it is quiet time, your message has been deleted. Here is your message in case you need to resend it at a later time:\n\n{message.content}""",
+                                     kind="deleted", append=True)
+                    log.info("Deleted message from %s, since it's been less than 30 minutes since their last message.", message.author)
+                # Deleted with the rest of the channel's batch, the DM waits until it is gone
+                self.deletions.add(message, on_deleted=deleted)
+                return False
+            else:
+                cooldowns.touch(guild_id, message.author.id) # Update Last Message Time
+        return True
+
+    async def _cannot_delete(self, channel):
+        try:
+            await track_call("send", channel.send("No permission to delete messages."))
+        except discord.Forbidden:
+            log.warning("No permission to send or delete messages in %s", channel.guild)
 
     @commands.Cog.listener()
+    @timed("on_typing")
     async def on_typing(self, channel, user, when):
         if isinstance(channel, discord.DMChannel) or user == self.bot.user:
             return
+        member = await self.members.resolve(channel.guild, user)
+        if member is None:
+            return
+        user = member
         if is_quiet_time(channel.guild.id, member=user): 
-            last_time = self.last_message.get(channel.guild.id, {}).get(user.id, None) # Get time of last message
-            if last_time is not None and datetime.now() < (last_time + timedelta(minutes=30)): # Check if it's been less than 30 minutes
-                try: 
-                    await user.send(f"""{user}, Don't even think about it. It is currently quiet time. It's been less than 30 minutes since your last message"""
-                                    )
-                except:
-                    print(f"No permission to send DM to {user}")
-                print(f"{user} thought about sending a message in {channel} at {when.ctime()}")
+            if self.cooldowns_for(channel.guild).in_cooldown(channel.guild.id, user.id): # Check if it's been less than 30 minutes
+                # Typing events repeat every few seconds, so warn at most once per 5 minutes
+                self.outbox.send(user, f"""{user}, Don't even think about it. It is currently quiet time. It's been less than 30 minutes since your last message""",
+                                 kind="typing", window=5 * 60)
+                log.info("%s thought about sending a message in %s at %s", user, channel, when.ctime())
                 return
                 
 
@@ -1,21 +1,120 @@
-import json
+import os
 from datetime import time
 from pathlib import Path
-from .config_models import RootConfig, QuietConfig
+from time import perf_counter
+from typing import Callable
+from .config_models import RootConfig, GuildConfig, QuietConfig
+from .config_store import JsonConfigStore, SQLiteConfigStore, migrate_json_to_sqlite
 
 CONFIG_FILE = "config.json"
 CONFIG_PATH = Path(__file__).resolve().parent.parent / CONFIG_FILE
+DB_FILE = "config.db"
+DB_PATH = Path(__file__).resolve().parent.parent / DB_FILE
+
+# Set DADBOT_CONFIG_BACKEND=sqlite to keep the config in config.db instead of config.json.
+# The first start with the SQLite backend imports an existing config.json.
+CONFIG_BACKEND = os.getenv("DADBOT_CONFIG_BACKEND", "json").lower()
+
+_store: JsonConfigStore | SQLiteConfigStore | None = None
+
+# Process-wide cache of the parsed config. It is kept current by write-through
+# from the set_*/clear_* functions below, and reloaded when the store changes
+# underneath us (config.json's mtime/size or another connection's commit).
+_cache: RootConfig | None = None
+_cache_stamp: object = None
+cache_stats = {"hits": 0, "misses": 0, "load_seconds": 0.0}
+# Time spent handing changes to the store, on the caller's thread
+save_stats = {"count": 0, "seconds": 0.0}
+
+# Callbacks run after a guild's config changes. They receive the guild id, or
+# None when the whole config was replaced (e.g. reloaded after an external edit).
+_listeners: list[Callable[[int | None], None]] = []
+
+def add_change_listener(callback: Callable[[int | None], None]) -> None:
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+def remove_change_listener(callback: Callable[[int | None], None]) -> None:
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+def _notify(guild_id: int | None) -> None:
+    for callback in list(_listeners):
+        callback(guild_id)
+
+def get_store() -> JsonConfigStore | SQLiteConfigStore:
+    global _store
+    if _store is None:
+        if CONFIG_BACKEND == "sqlite":
+            _store = migrate_json_to_sqlite(CONFIG_PATH, DB_PATH)
+        else:
+            _store = JsonConfigStore(CONFIG_PATH)
+    return _store
+
+def use_store(store: JsonConfigStore | SQLiteConfigStore) -> None:
+    """Switches to another backend, dropping the cached config"""
+    global _store
+    if _store is not None and _store is not store:
+        _store.close()
+    _store = store
+    invalidate_cache()
 
 def load_root() -> RootConfig:
-    if CONFIG_PATH.exists():
-        with CONFIG_PATH.open("r", encoding="utf-8") as file:
-            return RootConfig.from_dict(json.load(file))
-    return RootConfig()
+    """Returns the cached config, re-reading the store only if it changed"""
+    global _cache, _cache_stamp
+    store = get_store()
+    stamp = store.stamp()
+    if _cache is not None and stamp == _cache_stamp:
+        cache_stats["hits"] += 1
+        return _cache
+    cache_stats["misses"] += 1
+    started = perf_counter()
+    # Only the guilds someone else changed are re-read, if the store can tell which
+    changed = None if _cache is None else store.load_changes(_cache)
+    reloaded = _cache is not None and changed is None
+    if changed is None:
+        _cache = store.load()
+    cache_stats["load_seconds"] += perf_counter() - started
+    _cache_stamp = stamp
+    if reloaded:
+        _notify(None)
+    for guild_id in changed or ():
+        _notify(guild_id)
+    return _cache
 
 def save_root(root: RootConfig) -> None:
-    CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with CONFIG_PATH.open("w", encoding="utf-8") as file:
-        json.dump(root.to_dict(), file, indent=2)
+    global _cache, _cache_stamp
+    store = get_store()
+    started = perf_counter()
+    store.save_root(root)
+    _count_save(started)
+    replaced = root is not _cache
+    _cache = root
+    _cache_stamp = store.stamp()
+    if replaced:
+        _notify(None)
+
+def _count_save(started: float) -> None:
+    save_stats["count"] += 1
+    save_stats["seconds"] += perf_counter() - started
+
+def _saved(guild_id: int, started: float) -> None:
+    global _cache_stamp
+    _count_save(started)
+    _cache_stamp = get_store().stamp()
+    _notify(guild_id)
+
+def flush() -> None:
+    """Blocks until every pending change has been written out. Call before exiting."""
+    if _store is not None:
+        _store.flush()
+
+def invalidate_cache() -> None:
+    """Drops the cached config so the next load_root() re-reads the store"""
+    global _cache, _cache_stamp
+    _cache = None
+    _cache_stamp = None
+    _notify(None)
 
 def get_server_config(guild_id: int) -> QuietConfig:
     root = load_root()
@@ -26,7 +125,9 @@ def set_server_config(guild_id: int, **kwargs) -> None:
     guild = root.ensure_guild(guild_id)
     for k, v in kwargs.items():
         setattr(guild.server_config, k, v)
-    save_root(root)
+    started = perf_counter()
+    get_store().save_server_config(root, guild_id)
+    _saved(guild_id, started)
 
 def set_user_override(guild_id: int, user_id: int, **kwargs) -> None:
     root = load_root()
@@ -35,7 +136,9 @@ def set_user_override(guild_id: int, user_id: int, **kwargs) -> None:
     for k, v in kwargs.items():
         setattr(q, k, v)
     guild.overrides.users[user_id] = q
-    save_root(root)
+    started = perf_counter()
+    get_store().save_user_override(root, guild_id, user_id)
+    _saved(guild_id, started)
 
 def set_role_override(guild_id: int, role_id: int, **kwargs) -> None:
     root = load_root()
@@ -44,16 +147,33 @@ def set_role_override(guild_id: int, role_id: int, **kwargs) -> None:
     for k, v in kwargs.items():
         setattr(q, k, v)
     guild.overrides.roles[role_id] = q
-    save_root(root)
+    started = perf_counter()
+    get_store().save_role_override(root, guild_id, role_id)
+    _saved(guild_id, started)
 
 def clear_user_override(guild_id: int, user_id: int) -> None:
     root = load_root()
     guild = root.ensure_guild(guild_id)
     guild.overrides.users.pop(user_id, None)
-    save_root(root)
+    started = perf_counter()
+    get_store().save_user_override(root, guild_id, user_id)
+    _saved(guild_id, started)
 
 def clear_role_override(guild_id: int, role_id: int) -> None:
     root = load_root()
     guild = root.ensure_guild(guild_id)
     guild.overrides.roles.pop(role_id, None)
-    save_root(root)
\ No newline at end of file
+    started = perf_counter()
+    get_store().save_role_override(root, guild_id, role_id)
+    _saved(guild_id, started)
+
+def replace_guild(guild_id: int, config: GuildConfig) -> None:
+    """Replaces a guild's server config and all of its overrides with one write and one
+    change notification, however many overrides there are"""
+    root = load_root()
+    guild = root.ensure_guild(guild_id)
+    guild.server_config = config.server_config
+    guild.overrides = config.overrides
+    started = perf_counter()
+    get_store().save_guild(root, guild_id)
+    _saved(guild_id, started)
@@ -1,78 +1,234 @@
 from dataclasses import dataclass, field
-from datetime import time
+from datetime import date, time
+from .log import get_logger
 
+log = get_logger("config")
 
-def _str_to_time(tstr: str) -> time:
-    hh, mm = map(int, tstr.split(":"))
-    return time(int(hh), int(mm))
+DAY_CODES = "MTWRFSU" # Indexed by date.weekday()
+_DAY_BITS = {code: 1 << i for i, code in enumerate(DAY_CODES)}
+# Holidays are days of a leap year, so Feb 29 has an ordinal too
+_HOLIDAY_YEAR = 2000
+_UNSET = object()
 
-def _time_to_str(t: time | None) -> str | None:
-    if t is None: return None
-    return f"{t.hour:02d}:{t.minute:02d}"
+# Lookup tables so parsing and serializing the common values is a dict or list index
+_MINUTE_STRS = [f"{m // 60:02d}:{m % 60:02d}" for m in range(1440)]
+_STR_MINUTES = {s: m for m, s in enumerate(_MINUTE_STRS)}
+_MASK_DAYS = ["".join(code for i, code in enumerate(DAY_CODES) if mask >> i & 1) for mask in range(128)]
+_DAYS_MASK = {days: mask for mask, days in enumerate(_MASK_DAYS)}
 
-def _holidays_to_str(holidays: list[tuple[int,int]] | None) -> list[str]:
+def _str_to_minutes(tstr: str) -> int:
+    minutes = _STR_MINUTES.get(tstr)
+    if minutes is not None:
+        return minutes
+    try:
+        hh, mm = map(int, tstr.split(":"))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time {tstr!r}, expected HH:MM") from None
+    if not (0 <= hh <= 23 and 0 <= mm <= 59):
+        raise ValueError(f"Invalid time {tstr!r}, expected HH:MM")
+    return hh * 60 + mm
+
+def _minutes_to_str(minutes: int | None) -> str | None:
+    if minutes is None: return None
+    return _MINUTE_STRS[minutes]
+
+def _time_to_minutes(t: time | None) -> int | None:
+    return None if t is None else t.hour * 60 + t.minute
+
+def _minutes_to_time(minutes: int | None) -> time | None:
+    return None if minutes is None else time(minutes // 60, minutes % 60)
+
+def days_to_mask(days: str | None) -> int | None:
+    if days is None:
+        return None
+    mask = _DAYS_MASK.get(days)
+    if mask is not None:
+        return mask
+    mask = 0
+    for code in days.upper():
+        bit = _DAY_BITS.get(code)
+        if bit is None:
+            raise ValueError(f"Invalid quiet days {days!r}, use letters from {DAY_CODES}")
+        mask |= bit
+    return mask
+
+def mask_to_days(mask: int | None) -> str | None:
+    if mask is None:
+        return None
+    return _MASK_DAYS[mask]
+
+def holiday_ordinal(month: int, day: int) -> int:
+    try:
+        return date(_HOLIDAY_YEAR, int(month), int(day)).timetuple().tm_yday
+    except ValueError:
+        raise ValueError(f"Invalid holiday {month}/{day}") from None
+
+def _ordinal_to_holiday(ordinal: int) -> tuple[int, int]:
+    d = date.fromordinal(date(_HOLIDAY_YEAR, 1, 1).toordinal() + ordinal - 1)
+    return (d.month, d.day)
+
+def _holidays_to_ordinals(holidays) -> frozenset[int] | None:
     if holidays is None:
-        return []
-    out = []
-    for holiday in holidays:
-        out.append(f"{holiday[0]}/{holiday[1]}")
-    return out
-
-def _strs_to_holidays(strs: list[str]) -> list[tuple[int,int]]:
-    out = []
+        return None
+    return frozenset(holiday_ordinal(month, day) for month, day in holidays)
+
+# Few distinct holiday sets exist in practice, so conversions are memoized and the
+# parsed sets are shared between configs
+_holiday_strs: dict[frozenset[int], list[str]] = {}
+_holiday_sets: dict[tuple[str, ...], frozenset[int]] = {}
+
+def _holidays_to_str(ordinals: frozenset[int]) -> list[str]:
+    strs = _holiday_strs.get(ordinals)
+    if strs is None:
+        strs = _holiday_strs[ordinals] = [f"{month}/{day}" for month, day in map(_ordinal_to_holiday, sorted(ordinals))]
+    return list(strs)
+
+def _strs_to_ordinals(strs: list[str]) -> frozenset[int]:
+    key = tuple(strs)
+    ordinals = _holiday_sets.get(key)
+    if ordinals is None:
+        ordinals = _holiday_sets[key] = _parse_holidays(strs)
+    return ordinals
+
+def _parse_holidays(strs: list[str]) -> frozenset[int]:
+    out = set()
     for s in strs:
         nums = s.split("/")
-        month = nums[0]
-        date = nums[1]
-        out.append((month, date))
-    return out
+        if len(nums) != 2:
+            raise ValueError(f"Invalid holiday {s!r}, expected month/day")
+        out.add(holiday_ordinal(*nums))
+    return frozenset(out)
+
+def _optional_grace(value) -> int | None:
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"Invalid grace period {value!r}, expected a non-negative number of minutes")
+    return value
+
+_DEFAULT_HOLIDAYS = _holidays_to_ordinals([(1,1), (7,4), (11,11), (12,25)])
 
-@dataclass
 class QuietConfig:
-    """Dataclass for holding data regarding the quiet time configuration."""
-    start_time: time | None = time(0,30)
-    end_time: time | None = time(7, 0)
-    quiet_days: str | None = "MTWRF"
-    grace_period: int | None = 30
-    holidays: list[tuple[int,int]] | None = field(default_factory=lambda: [(1,1), (7,4), (11,11), (12,25)])
+    """Quiet time configuration. Any field can be None, which on an override means "not overridden".
+
+    Stored compactly: start, end as minutes of the day, days as a bitmask with bit i
+    for date.weekday() == i, and holidays as a frozenset of day-of-year ordinals. The
+    start_time/end_time/quiet_days/holidays properties give the original types."""
+    __slots__ = ("start", "end", "grace", "days", "holiday_ordinals")
+
+    def __init__(self, start_time: time | None = time(0,30), end_time: time | None = time(7, 0),
+                 quiet_days: str | None = "MTWRF", grace_period: int | None = 30, holidays=_UNSET):
+        self.start = _time_to_minutes(start_time)
+        self.end = _time_to_minutes(end_time)
+        self.days = days_to_mask(quiet_days)
+        self.grace = _optional_grace(grace_period)
+        self.holiday_ordinals = _DEFAULT_HOLIDAYS if holidays is _UNSET else _holidays_to_ordinals(holidays)
+
+    @classmethod
+    def _make(cls, start: int | None, end: int | None, days: int | None, grace: int | None,
+              holiday_ordinals: frozenset[int] | None) -> "QuietConfig":
+        """Builds a config from already-compact, already-validated fields"""
+        q = cls.__new__(cls)
+        q.start, q.end, q.days, q.grace, q.holiday_ordinals = start, end, days, grace, holiday_ordinals
+        return q
+
+    def _fields(self) -> tuple:
+        return (self.start, self.end, self.days, self.grace, self.holiday_ordinals)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, QuietConfig):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return (f"QuietConfig(start_time={self.start_time!r}, end_time={self.end_time!r}, quiet_days={self.quiet_days!r}, "
+                f"grace_period={self.grace!r}, holidays={self.holidays!r})")
+
+    @property
+    def start_time(self) -> time | None:
+        return _minutes_to_time(self.start)
+
+    @start_time.setter
+    def start_time(self, value: time | None) -> None:
+        self.start = _time_to_minutes(value)
+
+    @property
+    def end_time(self) -> time | None:
+        return _minutes_to_time(self.end)
+
+    @end_time.setter
+    def end_time(self, value: time | None) -> None:
+        self.end = _time_to_minutes(value)
+
+    @property
+    def quiet_days(self) -> str | None:
+        return mask_to_days(self.days)
+
+    @quiet_days.setter
+    def quiet_days(self, value: str | None) -> None:
+        self.days = days_to_mask(value)
+
+    @property
+    def grace_period(self) -> int | None:
+        return self.grace
+
+    @grace_period.setter
+    def grace_period(self, value: int | None) -> None:
+        self.grace = _optional_grace(value)
+
+    @property
+    def holidays(self) -> list[tuple[int,int]] | None:
+        """A new list each time, assign it back to change the holidays"""
+        if self.holiday_ordinals is None:
+            return None
+        return [_ordinal_to_holiday(o) for o in sorted(self.holiday_ordinals)]
+
+    @holidays.setter
+    def holidays(self, value: list[tuple[int,int]] | None) -> None:
+        self.holiday_ordinals = _holidays_to_ordinals(value)
 
     def to_dict(self) -> dict:
         return {
-            "start_time": _time_to_str(self.start_time),
-            "end_time": _time_to_str(self.end_time),
-            "quiet_days": self.quiet_days if self.quiet_days is not None else None,
-            "grace_period": self.grace_period if self.grace_period is not None else None,
-            "holidays": _holidays_to_str(self.holidays) if self.holidays is not None else None
+            "start_time": _minutes_to_str(self.start),
+            "end_time": _minutes_to_str(self.end),
+            "quiet_days": mask_to_days(self.days),
+            "grace_period": self.grace,
+            "holidays": _holidays_to_str(self.holiday_ordinals) if self.holiday_ordinals is not None else None
         }
     
     @classmethod
     def from_dict(cls, d: dict) -> "QuietConfig":
+        """Parses and validates the on-disk form. Missing keys get the defaults, raises ValueError on bad values."""
         if not d:
             return cls()
-        
-        def present(key):
-            return key in d
-        
-        start_time_raw = d.get("start_time") if present("start_time") else "00:30"
-        end_time_raw = d.get("end_time") if present("end_time") else "07:00"
-        holidays_raw = d.get("holidays") if present("holidays") else ["1/1", "7/4", "11/11", "12/25"]
-        
-        start_time = None if start_time_raw is None else _str_to_time(start_time_raw)
-        end_time = None if end_time_raw is None else _str_to_time(end_time_raw)
-        holidays = None if holidays_raw is None else _strs_to_holidays(holidays_raw)
-
-        quiet_days = d.get("quiet_days") if present("quiet_days") else "MTWRF"
-        grace_period = d.get("grace_period") if present("grace_period") else 30
-
-        return cls(
-            start_time=start_time,
-            end_time=end_time,
-            quiet_days=quiet_days,
-            grace_period=grace_period,
-            holidays=holidays,
+
+        start_time_raw = d.get("start_time", "00:30")
+        end_time_raw = d.get("end_time", "07:00")
+        holidays_raw = d["holidays"] if "holidays" in d else _UNSET
+
+        return cls._make(
+            None if start_time_raw is None else _str_to_minutes(start_time_raw),
+            None if end_time_raw is None else _str_to_minutes(end_time_raw),
+            days_to_mask(d.get("quiet_days", "MTWRF")),
+            _optional_grace(d.get("grace_period", 30)),
+            _DEFAULT_HOLIDAYS if holidays_raw is _UNSET else None if holidays_raw is None else _strs_to_ordinals(holidays_raw),
         )
 
-@dataclass
+_BAD_ENTRY = (ValueError, TypeError, AttributeError, KeyError)
+
+def _parse_entries(kind: str, raw: dict) -> dict[int, QuietConfig]:
+    """Parses overrides one by one, a bad entry is logged and skipped instead of failing the load"""
+    entries = {}
+    for target_id, config in raw.items():
+        try:
+            entries[int(target_id)] = QuietConfig.from_dict(config)
+        except _BAD_ENTRY as e:
+            log.warning("Skipping invalid %s override %s: %s", kind, target_id, e)
+    return entries
+
+@dataclass(slots=True)
 class Overrides:
     """Dataclass for holding data regarding user and role-specific overrides for quiet time configuration"""
     users: dict[int, QuietConfig] = field(default_factory=dict)
@@ -87,11 +243,9 @@ class Overrides:
     @classmethod
     def from_dict(cls, d: dict) -> "Overrides":
         d = d or {}
-        users = {int(user_id): QuietConfig.from_dict(config) for user_id, config in d.get("users", {}).items()}
-        roles = {int(role_id): QuietConfig.from_dict(config) for role_id, config in d.get("roles", {}).items()}
-        return cls(users=users, roles=roles)
+        return cls(users=_parse_entries("user", d.get("users", {})), roles=_parse_entries("role", d.get("roles", {})))
 
-@dataclass
+@dataclass(slots=True)
 class GuildConfig:
     """Dataclass for holding data regarding all configurations for a server"""
     server_id: int
@@ -107,29 +261,44 @@ class GuildConfig:
 
     @classmethod
     def from_dict(cls, d: dict) -> "GuildConfig":
-        return cls(
-            server_id=int(d["server_id"]),
-            server_config=QuietConfig.from_dict(d.get("server_config", {})),
-            overrides=Overrides.from_dict(d.get("overrides", {})),
-        )
+        server_id = int(d["server_id"])
+        try:
+            server_config = QuietConfig.from_dict(d.get("server_config", {}))
+        except _BAD_ENTRY as e:
+            log.warning("Invalid server config for %s, using the defaults: %s", server_id, e)
+            server_config = QuietConfig()
+        return cls(server_id=server_id, server_config=server_config, overrides=Overrides.from_dict(d.get("overrides", {})))
 
-@dataclass
+@dataclass(slots=True)
 class RootConfig:
     """Dataclass for holding data of all servers"""
     servers: list[GuildConfig] = field(default_factory=list)
+    _index: dict[int, GuildConfig] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._index = {s.server_id: s for s in self.servers}
 
     def to_dict(self) -> dict:
         return {"servers": [s.to_dict() for s in self.servers]}
 
     @classmethod
     def from_dict(cls, d: dict) -> "RootConfig":
-        servers = [GuildConfig.from_dict(s) for s in d.get("servers", [])]
+        servers = []
+        for s in d.get("servers", []):
+            try:
+                servers.append(GuildConfig.from_dict(s))
+            except _BAD_ENTRY as e:
+                log.warning("Skipping invalid server entry %r: %s", s.get("server_id") if isinstance(s, dict) else s, e)
         return cls(servers=servers)
 
+    def get_guild(self, guild_id: int) -> GuildConfig | None:
+        return self._index.get(guild_id)
+
     def ensure_guild(self, guild_id: int) -> GuildConfig:
-        for server in self.servers:
-            if server.server_id == guild_id:
-                return server
+        server = self._index.get(guild_id)
+        if server is not None:
+            return server
         g = GuildConfig(server_id=guild_id)
         self.servers.append(g)
-        return g
\ No newline at end of file
+        self._index[guild_id] = g
+        return g
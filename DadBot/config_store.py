@@ -0,0 +1,478 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from .config_models import RootConfig, GuildConfig, Overrides, QuietConfig
+from .log import get_logger
+from .writer import BatchWriter
+
+log = get_logger("config")
+
+# Storage backends for config_manager. Both hand out whole RootConfig objects on load;
+# the save_* methods are told which part of the root changed so a backend can persist
+# just that part.
+
+# Wait before retrying changes that failed to reach the disk
+RETRY_DELAY = 5.0
+
+class JsonConfigStore:
+    """Keeps the whole config in a single JSON file.
+
+    Changes are written behind on a single background thread so the event loop never
+    waits on the disk. Each batch of changes is appended to a journal next to the file;
+    config.json itself is only rewritten (atomically, through a temp file and a rename)
+    when the journal is compacted. load() replays any journal left over by a crash."""
+
+    def __init__(self, path: Path, *, coalesce_delay: float = 0.5, compact_every: int = 100, compact_interval: float = 300.0):
+        self.path = Path(path)
+        self.journal_path = self.path.with_suffix(self.path.suffix + ".journal")
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self._writer: BatchWriter[dict] = BatchWriter(self._write_batch, name="config-writer", log=log, what="config changes",
+                                                      delay=coalesce_delay, retry_delay=RETRY_DELAY)
+        self._lock = threading.Lock()
+        # Owned by the writer thread: the config as it is on disk, and journal bookkeeping
+        self._disk_root: RootConfig | None = None
+        self._journal_entries = 0
+        self._last_compaction = time.monotonic()
+        # stamp() bookkeeping: the file's mtime/size as we last read or wrote it, and a
+        # counter that only moves when someone else changes the file
+        self._own_stamp: tuple[int, int] | None = None
+        self._generation = 0
+
+    def _stat(self) -> tuple[int, int] | None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def stamp(self) -> int:
+        busy = self._writer.busy
+        with self._lock:
+            if busy:
+                return self._generation
+            current = self._stat()
+            if current != self._own_stamp:
+                self._own_stamp = current
+                self._generation += 1
+            return self._generation
+
+    def _read(self) -> tuple[RootConfig, int, bool]:
+        """Returns the config with the journal replayed over it, how many entries were
+        replayed, and whether the journal ends in a partial entry"""
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as file:
+                root = RootConfig.from_dict(json.load(file))
+        else:
+            root = RootConfig()
+        replayed = 0
+        torn = False
+        if self.journal_path.exists():
+            with self.journal_path.open("r", encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        op = json.loads(line)
+                    except json.JSONDecodeError:
+                        torn = True # Torn write at the end of the journal
+                        break
+                    root = _apply_op(root, op)
+                    replayed += 1
+                    if not line.endswith("\n"):
+                        torn = True # Complete, but the next entry would be appended to its line
+        return root, replayed, torn
+
+    def load(self) -> RootConfig:
+        with self._lock:
+            self._own_stamp = self._stat()
+        root, replayed, torn = self._read()
+        # The writer re-reads its own copy from disk before its next batch
+        self._writer.submit(self._reset_disk_root, replayed > 0 or torn)
+        return root
+
+    def load_changes(self, root: RootConfig) -> list[int] | None:
+        """The file has no record of what changed, so it is always re-read whole"""
+        return None
+
+    def save_root(self, root: RootConfig) -> None:
+        self._writer.add({"op": "root", "data": root.to_dict()})
+
+    def save_server_config(self, root: RootConfig, guild_id: int) -> None:
+        self._writer.add({"op": "server", "guild": guild_id, "config": root.ensure_guild(guild_id).server_config.to_dict()})
+
+    def save_user_override(self, root: RootConfig, guild_id: int, user_id: int) -> None:
+        config = root.ensure_guild(guild_id).overrides.users.get(user_id)
+        self._writer.add({"op": "user", "guild": guild_id, "id": user_id, "config": None if config is None else config.to_dict()})
+
+    def save_role_override(self, root: RootConfig, guild_id: int, role_id: int) -> None:
+        config = root.ensure_guild(guild_id).overrides.roles.get(role_id)
+        self._writer.add({"op": "role", "guild": guild_id, "id": role_id, "config": None if config is None else config.to_dict()})
+
+    def save_guild(self, root: RootConfig, guild_id: int) -> None:
+        self._writer.add({"op": "guild", "guild": guild_id, "data": root.ensure_guild(guild_id).to_dict()})
+
+    def flush(self) -> None:
+        """Blocks until every change is on disk and the journal is compacted. Raises
+        OSError if changes couldn't be written, they stay queued for another try."""
+        if not self._writer.flush():
+            raise OSError(f"Config changes could not be written to {self.path}")
+        self._writer.submit(self._compact_if_dirty).result()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._writer.shutdown()
+
+    # Everything below runs on the writer thread
+
+    def _reset_disk_root(self, compact: bool) -> None:
+        self._disk_root = None
+        if compact:
+            self._ensure_disk_root()
+            self._compact_if_dirty()
+
+    def _ensure_disk_root(self) -> RootConfig:
+        if self._disk_root is None:
+            self._disk_root, self._journal_entries, torn = self._read()
+            if torn:
+                # Nothing may be appended after a partial entry, it would be merged into it
+                # and lost along with everything after it on the next read
+                self._compact()
+        return self._disk_root
+
+    def _write_batch(self, ops: list[dict]) -> None:
+        try:
+            root = self._ensure_disk_root()
+            for op in ops:
+                root = _apply_op(root, op)
+            self._disk_root = root
+
+            if (any(op["op"] == "root" for op in ops)
+                    or self._journal_entries + len(ops) >= self.compact_every
+                    or time.monotonic() - self._last_compaction >= self.compact_interval):
+                self._compact()
+            else:
+                self._append(ops)
+        except BaseException:
+            # The in-memory copy may hold changes that aren't on disk, re-read it before the retry
+            self._disk_root = None
+            raise
+
+    def _append(self, ops: list[dict]) -> None:
+        size = self.journal_path.stat().st_size if self.journal_path.exists() else 0
+        try:
+            with self.journal_path.open("a", encoding="utf-8") as journal:
+                journal.write("".join(json.dumps(op, separators=(",", ":")) + "\n" for op in ops))
+                journal.flush()
+                os.fsync(journal.fileno())
+        except BaseException:
+            # Cut off what made it out before the retry appends again
+            try:
+                os.truncate(self.journal_path, size)
+            except FileNotFoundError:
+                pass # Nothing was written
+            except OSError:
+                log.warning("Couldn't truncate %s, it is compacted before the next write", self.journal_path)
+            raise
+        self._journal_entries += len(ops)
+
+    def _compact_if_dirty(self) -> None:
+        if self._journal_entries or self.journal_path.exists():
+            self._compact()
+
+    def _compact(self) -> None:
+        root = self._ensure_disk_root()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp.open("w", encoding="utf-8") as file:
+            json.dump(root.to_dict(), file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        with self._lock:
+            os.replace(tmp, self.path)
+            self._own_stamp = self._stat()
+        # Replaying journal entries over the new snapshot is harmless, so a crash
+        # between the rename and this truncation loses nothing
+        if self.journal_path.exists():
+            self.journal_path.unlink()
+        self._journal_entries = 0
+        self._last_compaction = time.monotonic()
+
+def _apply_op(root: RootConfig, op: dict) -> RootConfig:
+    """Applies one journal entry. Entries hold whole configs, so replaying one twice is harmless."""
+    kind = op["op"]
+    if kind == "root":
+        return RootConfig.from_dict(op["data"])
+    guild = root.ensure_guild(int(op["guild"]))
+    if kind == "server":
+        guild.server_config = QuietConfig.from_dict(op["config"])
+    elif kind == "guild":
+        replacement = GuildConfig.from_dict(op["data"])
+        guild.server_config, guild.overrides = replacement.server_config, replacement.overrides
+    elif kind in ("user", "role"):
+        target = guild.overrides.users if kind == "user" else guild.overrides.roles
+        if op["config"] is None:
+            target.pop(int(op["id"]), None)
+        else:
+            target[int(op["id"])] = QuietConfig.from_dict(op["config"])
+    return root
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS guilds (
+    guild_id INTEGER PRIMARY KEY,
+    start_time TEXT,
+    end_time TEXT,
+    quiet_days TEXT,
+    grace_period INTEGER,
+    has_holidays INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS user_overrides (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    quiet_days TEXT,
+    grace_period INTEGER,
+    has_holidays INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS role_overrides (
+    guild_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    quiet_days TEXT,
+    grace_period INTEGER,
+    has_holidays INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (guild_id, role_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS holidays (
+    guild_id INTEGER NOT NULL,
+    scope TEXT NOT NULL,
+    target_id INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    day INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS holidays_target ON holidays (guild_id, scope, target_id);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER -- NULL when the whole config was replaced
+);
+"""
+
+# How many entries of the change log are kept. A process that falls further behind re-reads everything.
+CHANGE_LOG_SIZE = 1000
+
+# holidays.scope values, target_id is 0 for the server config
+_SERVER, _USER, _ROLE = "server", "user", "role"
+
+def _config_row(config: QuietConfig) -> tuple:
+    d = config.to_dict()
+    return (d["start_time"], d["end_time"], d["quiet_days"], d["grace_period"], int(d["holidays"] is not None))
+
+class SQLiteConfigStore:
+    """Keeps the config in a SQLite database in WAL mode, one row per guild and override.
+
+    Changes only touch the rows they affect, and several processes (e.g. shards) can
+    share one database. stamp() changes whenever another connection commits; every
+    commit also logs the guild it changed so the others can re-read just that guild."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        self._seen = 0 # Last change log entry this connection has caught up with
+
+    def stamp(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def is_empty(self) -> bool:
+        return self._conn.execute("SELECT 1 FROM guilds LIMIT 1").fetchone() is None
+
+    def flush(self) -> None:
+        pass # Every change is committed as it is made
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def load(self) -> RootConfig:
+        with self._read():
+            self._seen = self._latest_change()
+            return RootConfig(servers=list(self._read_guilds().values()))
+
+    def load_changes(self, root: RootConfig) -> list[int] | None:
+        """Re-reads into `root` the guilds other connections changed since the last load.
+        Returns their ids, or None if the whole config has to be loaded again."""
+        with self._read():
+            rows = self._conn.execute("SELECT seq, guild_id FROM changes WHERE seq > ? ORDER BY seq", (self._seen,)).fetchall()
+            if not rows:
+                return []
+            # A gap means the log was pruned past what we've seen
+            if rows[0][0] != self._seen + 1 or any(guild_id is None for _, guild_id in rows):
+                return None
+            changed = list(dict.fromkeys(guild_id for _, guild_id in rows))
+            for guild_id in changed:
+                loaded = self._read_guilds(guild_id).get(guild_id) or GuildConfig(server_id=guild_id)
+                guild = root.ensure_guild(guild_id)
+                guild.server_config, guild.overrides = loaded.server_config, loaded.overrides
+            self._seen = rows[-1][0]
+        return changed
+
+    def _latest_change(self) -> int:
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def _read_guilds(self, guild_id: int | None = None) -> dict[int, GuildConfig]:
+        """Every guild, or just `guild_id`"""
+        conn = self._conn
+        where, params = ("", ()) if guild_id is None else (" WHERE guild_id = ?", (guild_id,))
+        holidays: dict[tuple[int, str, int], list[str]] = {}
+        for guild_id, scope, target_id, month, day in conn.execute(
+                f"SELECT guild_id, scope, target_id, month, day FROM holidays{where} ORDER BY rowid", params):
+            holidays.setdefault((guild_id, scope, target_id), []).append(f"{month}/{day}")
+
+        def config(row: tuple, key: tuple[int, str, int]) -> QuietConfig:
+            start_time, end_time, quiet_days, grace_period, has_holidays = row
+            return QuietConfig.from_dict({
+                "start_time": start_time,
+                "end_time": end_time,
+                "quiet_days": quiet_days,
+                "grace_period": grace_period,
+                "holidays": holidays.get(key, []) if has_holidays else None,
+            })
+
+        guilds: dict[int, GuildConfig] = {}
+        for guild_id, *row in conn.execute(
+                f"SELECT guild_id, start_time, end_time, quiet_days, grace_period, has_holidays FROM guilds{where} ORDER BY rowid", params):
+            guilds[guild_id] = GuildConfig(server_id=guild_id, server_config=config(tuple(row), (guild_id, _SERVER, 0)), overrides=Overrides())
+        for guild_id, user_id, *row in conn.execute(
+                f"SELECT guild_id, user_id, start_time, end_time, quiet_days, grace_period, has_holidays FROM user_overrides{where}", params):
+            if guild_id in guilds:
+                guilds[guild_id].overrides.users[user_id] = config(tuple(row), (guild_id, _USER, user_id))
+        for guild_id, role_id, *row in conn.execute(
+                f"SELECT guild_id, role_id, start_time, end_time, quiet_days, grace_period, has_holidays FROM role_overrides{where}", params):
+            if guild_id in guilds:
+                guilds[guild_id].overrides.roles[role_id] = config(tuple(row), (guild_id, _ROLE, role_id))
+        return guilds
+
+    def _write_holidays(self, guild_id: int, scope: str, target_id: int, config: QuietConfig | None) -> None:
+        self._conn.execute("DELETE FROM holidays WHERE guild_id = ? AND scope = ? AND target_id = ?", (guild_id, scope, target_id))
+        if config is not None and config.holidays:
+            self._conn.executemany(
+                "INSERT INTO holidays (guild_id, scope, target_id, month, day) VALUES (?, ?, ?, ?, ?)",
+                [(guild_id, scope, target_id, int(month), int(day)) for month, day in config.holidays])
+
+    def _upsert_guild(self, guild: GuildConfig) -> None:
+        self._conn.execute(
+            "INSERT INTO guilds (guild_id, start_time, end_time, quiet_days, grace_period, has_holidays) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (guild_id) DO UPDATE SET start_time = excluded.start_time, end_time = excluded.end_time, "
+            "quiet_days = excluded.quiet_days, grace_period = excluded.grace_period, has_holidays = excluded.has_holidays",
+            (guild.server_id, *_config_row(guild.server_config)))
+        self._write_holidays(guild.server_id, _SERVER, 0, guild.server_config)
+
+    def _write_override(self, table: str, column: str, scope: str, guild: GuildConfig, target_id: int, config: QuietConfig | None) -> None:
+        # The guild row has to exist for the override to be loaded back
+        self._conn.execute("INSERT OR IGNORE INTO guilds (guild_id, start_time, end_time, quiet_days, grace_period, has_holidays) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", (guild.server_id, *_config_row(guild.server_config)))
+        if config is None:
+            self._conn.execute(f"DELETE FROM {table} WHERE guild_id = ? AND {column} = ?", (guild.server_id, target_id))
+        else:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {table} (guild_id, {column}, start_time, end_time, quiet_days, grace_period, has_holidays) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (guild.server_id, target_id, *_config_row(config)))
+        self._write_holidays(guild.server_id, scope, target_id, config)
+
+    def save_root(self, root: RootConfig) -> None:
+        with self._transaction(None):
+            for table in ("guilds", "user_overrides", "role_overrides", "holidays"):
+                self._conn.execute(f"DELETE FROM {table}")
+            for guild in root.servers:
+                self._upsert_guild(guild)
+                for user_id, config in guild.overrides.users.items():
+                    self._write_override("user_overrides", "user_id", _USER, guild, user_id, config)
+                for role_id, config in guild.overrides.roles.items():
+                    self._write_override("role_overrides", "role_id", _ROLE, guild, role_id, config)
+
+    def save_server_config(self, root: RootConfig, guild_id: int) -> None:
+        with self._transaction(guild_id):
+            self._upsert_guild(root.ensure_guild(guild_id))
+
+    def save_user_override(self, root: RootConfig, guild_id: int, user_id: int) -> None:
+        guild = root.ensure_guild(guild_id)
+        with self._transaction(guild_id):
+            self._write_override("user_overrides", "user_id", _USER, guild, user_id, guild.overrides.users.get(user_id))
+
+    def save_role_override(self, root: RootConfig, guild_id: int, role_id: int) -> None:
+        guild = root.ensure_guild(guild_id)
+        with self._transaction(guild_id):
+            self._write_override("role_overrides", "role_id", _ROLE, guild, role_id, guild.overrides.roles.get(role_id))
+
+    def save_guild(self, root: RootConfig, guild_id: int) -> None:
+        """Replaces the guild's row, all its overrides and their holidays in one transaction"""
+        guild = root.ensure_guild(guild_id)
+        columns = "start_time, end_time, quiet_days, grace_period, has_holidays"
+        holidays = [(guild_id, scope, target_id, month, day)
+                    for scope, overrides in ((_USER, guild.overrides.users), (_ROLE, guild.overrides.roles))
+                    for target_id, config in overrides.items() for month, day in config.holidays or ()]
+        with self._transaction(guild_id):
+            for table in ("user_overrides", "role_overrides", "holidays"):
+                self._conn.execute(f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,))
+            self._upsert_guild(guild)
+            self._conn.executemany(f"INSERT INTO user_overrides (guild_id, user_id, {columns}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [(guild_id, user_id, *_config_row(config)) for user_id, config in guild.overrides.users.items()])
+            self._conn.executemany(f"INSERT INTO role_overrides (guild_id, role_id, {columns}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [(guild_id, role_id, *_config_row(config)) for role_id, config in guild.overrides.roles.items()])
+            self._conn.executemany("INSERT INTO holidays (guild_id, scope, target_id, month, day) VALUES (?, ?, ?, ?, ?)", holidays)
+
+    def _transaction(self, guild_id: int | None) -> "_Transaction":
+        """A write transaction that logs a change to `guild_id`, None for the whole config"""
+        return _Transaction(self, guild_id)
+
+    def _read(self) -> "_Transaction":
+        """A read transaction, so everything read comes from one snapshot"""
+        return _Transaction(self, None, write=False)
+
+class _Transaction:
+    def __init__(self, store: SQLiteConfigStore, guild_id: int | None, *, write: bool = True):
+        self._store = store
+        self._conn = store._conn
+        self._guild_id = guild_id
+        self._write = write
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE" if self._write else "BEGIN")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type or not self._write:
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+            return False
+        store = self._store
+        try:
+            caught_up = store._latest_change() == store._seen
+            seq = self._conn.execute("INSERT INTO changes (guild_id) VALUES (?)", (self._guild_id,)).lastrowid
+            self._conn.execute("DELETE FROM changes WHERE seq <= ?", (seq - CHANGE_LOG_SIZE,))
+            self._conn.execute("COMMIT")
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+        if caught_up:
+            # Our own change is already in the cache, nothing else happened in between
+            store._seen = seq
+        return False
+
+def migrate_json_to_sqlite(json_path: Path, db_path: Path) -> SQLiteConfigStore:
+    """One-time import of an existing config.json into a SQLite store"""
+    store = SQLiteConfigStore(db_path)
+    if store.is_empty() and Path(json_path).exists():
+        store.save_root(JsonConfigStore(json_path)._read()[0])
+        log.info("Migrated %s to %s", json_path, db_path)
+    return store
@@ -0,0 +1,104 @@
+import json
+from typing import Callable
+from .config_models import GuildConfig, Overrides, QuietConfig
+
+# $parental export/import: a guild's server config and overrides as one JSON document,
+# the same shape GuildConfig has in config.json
+
+MAX_GRACE_MINUTES = 240 # Same limit as the grace commands
+_CONFIG_FIELDS = ("start_time", "end_time", "quiet_days", "grace_period", "holidays")
+_CONFIG_KEYS = frozenset(_CONFIG_FIELDS)
+_GUILD_KEYS = frozenset(("server_id", "server_config", "overrides"))
+
+def export_guild(config: GuildConfig) -> bytes:
+    return json.dumps(config.to_dict(), indent=2).encode("utf-8")
+
+# Keys an override leaves out aren't overridden, like with the override commands
+_NOT_OVERRIDDEN = {"start_time": None, "end_time": None, "quiet_days": None, "grace_period": None}
+
+def _parse_config(where: str, raw, errors: list[str], *, override: bool = False) -> QuietConfig | None:
+    """Checks every field on its own so all of a config's problems are reported"""
+    if not isinstance(raw, dict):
+        errors.append(f"{where}: expected an object")
+        return None
+    valid = True
+    unknown = raw.keys() - _CONFIG_KEYS
+    if unknown:
+        errors.append(f"{where}: unknown keys {', '.join(sorted(unknown))}")
+        valid = False
+    if override:
+        raw = _NOT_OVERRIDDEN | raw
+    for key in _CONFIG_FIELDS:
+        if key not in raw:
+            continue
+        try:
+            field = QuietConfig.from_dict({key: raw[key]})
+        except (ValueError, TypeError, AttributeError) as e:
+            errors.append(f"{where}.{key}: {e}")
+            valid = False
+            continue
+        if key == "grace_period" and field.grace is not None and field.grace > MAX_GRACE_MINUTES:
+            errors.append(f"{where}.{key}: must be at most {MAX_GRACE_MINUTES} minutes")
+            valid = False
+    return QuietConfig.from_dict({k: v for k, v in raw.items() if k in _CONFIG_KEYS}) if valid else None
+
+def _parse_overrides(kind: str, raw, errors: list[str]) -> dict[int, QuietConfig]:
+    if not isinstance(raw, dict):
+        errors.append(f"overrides.{kind}: expected an object of id -> config")
+        return {}
+    parsed: dict[int, QuietConfig] = {}
+    for key, value in raw.items():
+        try:
+            target_id = int(key)
+        except ValueError:
+            errors.append(f"overrides.{kind}.{key}: not a {kind[:-1]} id")
+            continue
+        config = _parse_config(f"overrides.{kind}.{key}", value, errors, override=True)
+        if config is not None:
+            parsed[target_id] = config
+    return parsed
+
+def parse_import(data: bytes, guild_id: int) -> tuple[GuildConfig | None, list[str]]:
+    """Parses and validates an exported config in one pass. Returns the config, or None and
+    every problem found, so a bad file can be fixed in one go."""
+    try:
+        raw = json.loads(data)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        return None, [f"Not a JSON file: {e}"]
+    if not isinstance(raw, dict):
+        return None, ["Expected an object with server_config and overrides"]
+    errors: list[str] = []
+    unknown = raw.keys() - _GUILD_KEYS
+    if unknown:
+        errors.append(f"Unknown keys {', '.join(sorted(unknown))}")
+    server_config = _parse_config("server_config", raw.get("server_config", {}), errors)
+    overrides = raw.get("overrides", {})
+    if not isinstance(overrides, dict):
+        errors.append("overrides: expected an object with users and roles")
+        overrides = {}
+    users = _parse_overrides("users", overrides.get("users", {}), errors)
+    roles = _parse_overrides("roles", overrides.get("roles", {}), errors)
+    if errors or server_config is None:
+        return None, errors
+    return GuildConfig(server_id=guild_id, server_config=server_config, overrides=Overrides(users=users, roles=roles)), []
+
+def _config_changes(old: QuietConfig, new: QuietConfig) -> str:
+    before, after = old.to_dict(), new.to_dict()
+    return ", ".join(f"{key} {before[key]} -> {after[key]}" for key in before if before[key] != after[key])
+
+def diff_guilds(old: GuildConfig, new: GuildConfig, label: Callable[[str, int], str] = lambda kind, target_id: f"{kind} {target_id}") -> list[str]:
+    """One line per changed config: "~" changed, "+" added, "-" removed override.
+    `label(kind, id)` names a user or role."""
+    lines = []
+    if old.server_config != new.server_config:
+        lines.append(f"~ server: {_config_changes(old.server_config, new.server_config)}")
+    for kind, before, after in (("role", old.overrides.roles, new.overrides.roles), ("user", old.overrides.users, new.overrides.users)):
+        for target_id, config in after.items():
+            previous = before.get(target_id)
+            if previous is None:
+                fields = ", ".join(f"{k} {v}" for k, v in config.to_dict().items() if v is not None)
+                lines.append(f"+ {label(kind, target_id)}: {fields}")
+            elif previous != config:
+                lines.append(f"~ {label(kind, target_id)}: {_config_changes(previous, config)}")
+        lines += [f"- {label(kind, target_id)}" for target_id in before if target_id not in after]
+    return lines
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from .log import get_logger
+
+log = get_logger("messages")
+
+COOLDOWN_FILE = "cooldowns.json"
+COOLDOWN_PATH = Path(__file__).resolve().parent.parent / COOLDOWN_FILE
+
+def cooldown_path(shard_id: int | None = None) -> Path:
+    """Snapshot file for one shard, so shards running as separate processes don't overwrite each other"""
+    if shard_id is None:
+        return COOLDOWN_PATH
+    return COOLDOWN_PATH.with_name(f"{COOLDOWN_PATH.stem}-{shard_id}{COOLDOWN_PATH.suffix}")
+
+def pack_key(guild_id: int, user_id: int) -> int:
+    """One int for a pair of snowflakes, they fit in 64 bits. Cheaper to keep than a tuple."""
+    return (guild_id << 64) | user_id
+
+class CooldownStore:
+    """When each cooldown started, as epoch seconds. Cooldowns are per guild and member
+    (quiet-time messages) or per guild and channel (jokes), any snowflake works.
+
+    Entries are kept oldest first, so expired ones are swept from the front, and the
+    oldest are evicted first once max_entries is reached. The store can be snapshotted
+    to disk so cooldowns survive a restart."""
+
+    def __init__(self, ttl: int = 30 * 60, max_entries: int = 100_000, path: Path | None = COOLDOWN_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: OrderedDict[int, int] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, guild_id: int, user_id: int, now: float | None = None) -> int | None:
+        """Returns when the member's cooldown started, or None if it isn't running"""
+        key = pack_key(guild_id, user_id)
+        started = self._entries.get(key)
+        if started is None:
+            return None
+        if (now or time.time()) >= started + self.ttl:
+            del self._entries[key]
+            return None
+        return started
+
+    def in_cooldown(self, guild_id: int, user_id: int, now: float | None = None) -> bool:
+        return self.get(guild_id, user_id, now) is not None
+
+    def touch(self, guild_id: int, user_id: int, now: float | None = None) -> None:
+        """Starts (or restarts) a member's cooldown"""
+        key = pack_key(guild_id, user_id)
+        now = now or time.time()
+        self._entries[key] = int(now)
+        self._entries.move_to_end(key)
+        self.sweep(now) # Only looks at the front, so this stays cheap
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def sweep(self, now: float | None = None) -> int:
+        """Drops expired entries and returns how many were removed"""
+        cutoff = (now or time.time()) - self.ttl
+        removed = 0
+        while self._entries:
+            key, started = next(iter(self._entries.items()))
+            if started > cutoff:
+                break
+            del self._entries[key]
+            removed += 1
+        return removed
+
+    def _write(self, entries: list[list[int]]) -> None:
+        assert self.path is not None
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp.open("w", encoding="utf-8") as file:
+            json.dump({"ttl": self.ttl, "entries": entries}, file, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    async def save(self) -> None:
+        """Snapshots the live entries to disk off the event loop"""
+        if self.path is None:
+            return
+        self.sweep()
+        entries = [[key >> 64, key & 0xFFFFFFFFFFFFFFFF, started] for key, started in self._entries.items()]
+        await asyncio.to_thread(self._write, entries)
+
+    def restore(self) -> int:
+        """Loads a snapshot written by save() and returns how many entries are still live"""
+        if self.path is None or not self.path.exists():
+            return 0
+        try:
+            with self.path.open("r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            log.warning("Could not restore cooldowns from %s: %r", self.path, e)
+            return 0
+        for guild_id, user_id, started in sorted(data.get("entries", []), key=lambda e: e[2]):
+            self.touch(guild_id, user_id, started)
+        self.sweep()
+        return len(self._entries)
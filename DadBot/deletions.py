@@ -0,0 +1,108 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+import discord
+from .log import get_logger
+from .metrics import registry, track_call
+
+log = get_logger("messages")
+
+# Bulk delete only accepts messages younger than two weeks, keep a margin for clock skew
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)
+BULK_DELETE_MAX = 100
+
+_batch_sizes = registry.histogram("dadbot_delete_batch_size", "Messages removed per deletion flush",
+                                  buckets=(1, 2, 5, 10, 25, 50, 100))
+
+def _deleted(entries: list[tuple[discord.Message, Callable[[], None] | None]]) -> None:
+    for _, on_deleted in entries:
+        if on_deleted is not None:
+            try:
+                on_deleted()
+            except Exception:
+                log.exception("Deletion callback failed")
+
+class DeletionBuffer:
+    """Collects messages to delete per channel and removes them with one bulk delete call.
+
+    A channel's buffer is flushed `delay` seconds after its first message arrives, or as
+    soon as it holds `batch_size` messages. Messages too old for bulk delete, and lone
+    messages, are deleted one by one. A message's `on_deleted` callback only runs once
+    Discord has confirmed its deletion."""
+
+    def __init__(self, delay: float | None = None, batch_size: int | None = None,
+                 on_forbidden: Callable[[discord.TextChannel], Awaitable[None]] | None = None):
+        self.delay = delay if delay is not None else float(os.getenv("DADBOT_DELETE_DELAY", "1.0"))
+        self.batch_size = min(BULK_DELETE_MAX, batch_size or int(os.getenv("DADBOT_DELETE_BATCH", str(BULK_DELETE_MAX))))
+        self.on_forbidden = on_forbidden
+        self._buffers: dict[int, list[tuple[discord.Message, Callable[[], None] | None]]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._flushing: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return sum(len(messages) for messages in self._buffers.values())
+
+    def add(self, message: discord.Message, on_deleted: Callable[[], None] | None = None) -> None:
+        channel_id = message.channel.id
+        buffer = self._buffers.setdefault(channel_id, [])
+        buffer.append((message, on_deleted))
+        if len(buffer) >= self.batch_size:
+            self._start_flush(channel_id)
+        elif channel_id not in self._timers:
+            self._timers[channel_id] = asyncio.get_running_loop().call_later(self.delay, self._start_flush, channel_id)
+
+    def _start_flush(self, channel_id: int) -> None:
+        timer = self._timers.pop(channel_id, None)
+        if timer is not None:
+            timer.cancel()
+        messages = self._buffers.pop(channel_id, None)
+        if not messages:
+            return
+        task = asyncio.create_task(self._flush(messages))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def flush(self) -> None:
+        """Flushes every channel now and waits for the deletes to finish"""
+        for channel_id in list(self._buffers):
+            self._start_flush(channel_id)
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    async def _flush(self, messages: list[tuple[discord.Message, Callable[[], None] | None]]) -> None:
+        channel = messages[0][0].channel
+        cutoff = datetime.now(timezone.utc) - BULK_DELETE_MAX_AGE
+        recent = [entry for entry in messages if entry[0].created_at > cutoff]
+        single = [entry for entry in messages if entry[0].created_at <= cutoff]
+        _batch_sizes.observe(len(messages))
+        try:
+            if len(recent) > 1:
+                try:
+                    await track_call("bulk_delete", channel.delete_messages([m for m, _ in recent])) # type: ignore
+                except discord.Forbidden:
+                    raise
+                except discord.HTTPException as e:
+                    log.warning("Bulk delete of %d messages in %s failed, deleting one by one: %s", len(recent), channel, e)
+                    single.extend(recent)
+                else:
+                    _deleted(recent)
+            else:
+                single.extend(recent)
+            for entry in single:
+                try:
+                    await track_call("delete", entry[0].delete())
+                except discord.NotFound:
+                    continue # Already gone, not by us
+                except discord.Forbidden:
+                    raise
+                except discord.HTTPException as e:
+                    log.warning("Failed to delete a message in %s: %s", channel, e)
+                    continue
+                _deleted([entry])
+        except discord.Forbidden:
+            log.warning("No permission to delete messages in %s", getattr(channel, "guild", channel))
+            if self.on_forbidden is not None:
+                await self.on_forbidden(channel)
+        except Exception:
+            log.exception("Failed to delete %d messages in %s", len(messages), channel)
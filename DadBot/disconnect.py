@@ -0,0 +1,160 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterable
+import discord
+from .log import get_logger
+from .metrics import track_call
+
+log = get_logger("voice")
+
+@dataclass
+class SweepStats:
+    """Counters for one batch of disconnects"""
+    queued: int = 0
+    kicked: int = 0
+    failed: int = 0
+    skipped: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: float | None = None
+
+    @property
+    def wall_time(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def __str__(self) -> str:
+        return (f"queued={self.queued} kicked={self.kicked} failed={self.failed} "
+                f"skipped={self.skipped} wall={self.wall_time:.2f}s")
+
+@dataclass
+class _Job:
+    member: discord.Member
+    reason: str | None
+    stats: SweepStats | None
+    future: asyncio.Future
+
+class DisconnectExecutor:
+    """Disconnects members from voice with a bounded pool of workers.
+
+    Each guild has its own queue with up to `per_guild` requests in flight. Member edits
+    share a per-guild rate limit bucket, and discord.py holds requests back once it runs
+    out, so the bound only keeps one big guild from taking every worker. A 429 pauses
+    the whole guild."""
+
+    def __init__(self, workers: int = 16, max_retries: int = 3, per_guild: int = 8):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.per_guild = per_guild
+        self._queues: dict[int, deque[_Job]] = {}
+        self._active: dict[int, int] = {} # Jobs per guild that were handed to the workers and haven't finished
+        self._queued: set[tuple[int, int]] = set()
+        self._blocked_until: dict[int, float] = {}
+        self._ready: asyncio.Queue[_Job] | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def is_queued(self, member: discord.Member) -> bool:
+        return (member.guild.id, member.id) in self._queued
+
+    def submit(self, member: discord.Member, *, reason: str | None = None, stats: SweepStats | None = None) -> asyncio.Future | None:
+        """Queues a disconnect. Returns None if the member is already queued."""
+        self.start()
+        assert self._ready is not None
+        key = (member.guild.id, member.id)
+        if key in self._queued:
+            if stats is not None:
+                stats.skipped += 1
+            return None
+        self._queued.add(key)
+        if stats is not None:
+            stats.queued += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(member.guild.id, deque()).append(_Job(member, reason, stats, future))
+        self._dispatch(member.guild.id)
+        return future
+
+    def _dispatch(self, guild_id: int) -> None:
+        """Hands the guild's queued jobs to the workers, up to per_guild at a time"""
+        assert self._ready is not None
+        queue = self._queues[guild_id]
+        active = self._active.get(guild_id, 0)
+        while queue and active < self.per_guild:
+            self._ready.put_nowait(queue.popleft())
+            active += 1
+        if active:
+            self._active[guild_id] = active
+        if not queue:
+            del self._queues[guild_id]
+
+    async def sweep(self, members: Iterable[discord.Member], *, reason: str | None = None) -> SweepStats:
+        """Disconnects every given member and waits for all of them to finish"""
+        stats = SweepStats()
+        futures = [f for f in (self.submit(m, reason=reason, stats=stats) for m in members) if f is not None]
+        if futures:
+            await asyncio.gather(*futures)
+        stats.finished = time.monotonic()
+        return stats
+
+    async def _worker(self) -> None:
+        assert self._ready is not None
+        while True:
+            job = await self._ready.get()
+            guild_id = job.member.guild.id
+            try:
+                ok = await self._disconnect(job)
+            except Exception:
+                log.exception("Failed to disconnect %s", job.member)
+                ok = False
+            finally:
+                self._queued.discard((guild_id, job.member.id))
+                self._active[guild_id] -= 1
+                if not self._active[guild_id]:
+                    del self._active[guild_id]
+                if guild_id in self._queues:
+                    self._dispatch(guild_id)
+
+            if job.stats is not None:
+                if ok is None:
+                    job.stats.skipped += 1
+                elif ok:
+                    job.stats.kicked += 1
+                else:
+                    job.stats.failed += 1
+            if not job.future.done():
+                job.future.set_result(ok)
+
+    async def _disconnect(self, job: _Job) -> bool | None:
+        guild_id = job.member.guild.id
+        for attempt in range(self.max_retries + 1):
+            delay = self._blocked_until.get(guild_id, 0.0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if job.member.voice is None or job.member.voice.channel is None:
+                return None # Already left
+            try:
+                await track_call("move_to", job.member.move_to(None, reason=job.reason))
+                return True
+            except discord.Forbidden:
+                log.warning("No permission to disconnect %s", job.member)
+                return False
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500:
+                    log.warning("Failed to disconnect %s: %s", job.member, e)
+                    return False
+                retry_after = getattr(e, "retry_after", None) or min(2 ** attempt, 30)
+                self._blocked_until[guild_id] = time.monotonic() + retry_after
+        log.warning("Gave up disconnecting %s after %d attempts", job.member, self.max_retries + 1)
+        return False
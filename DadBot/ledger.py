@@ -0,0 +1,249 @@
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from .cooldowns import pack_key
+from .log import get_logger
+from .writer import BatchWriter
+
+log = get_logger("money")
+
+LEDGER_FILE = "ledger.db"
+LEDGER_PATH = Path(__file__).resolve().parent.parent / LEDGER_FILE
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    balance INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    reason TEXT,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_member ON transactions (guild_id, user_id, id);
+CREATE INDEX IF NOT EXISTS balances_leaderboard ON balances (guild_id, balance DESC);
+CREATE TABLE IF NOT EXISTS payout_rules (
+    guild_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL, -- 0 pays everyone
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, role_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS payouts (
+    guild_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    members INTEGER NOT NULL DEFAULT 0,
+    paid_at INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, role_id, period)
+) WITHOUT ROWID;
+"""
+
+# Largest single amount in cents. Balances are SQLite int64s, this leaves room for many
+# maxed-out changes before a sum could overflow.
+MAX_AMOUNT = 10 ** 15
+# Wait before retrying a batch that failed to commit
+RETRY_DELAY = 1.0
+
+_INSERT_TRANSACTION = "INSERT INTO transactions (guild_id, user_id, amount, reason, created_at) VALUES (?, ?, ?, ?, ?)"
+_ADD_BALANCE = ("INSERT INTO balances (guild_id, user_id, balance) VALUES (?, ?, ?) "
+                "ON CONFLICT (guild_id, user_id) DO UPDATE SET balance = balance + excluded.balance")
+_SELECT_BALANCE = "SELECT balance FROM balances WHERE guild_id = ? AND user_id = ?"
+
+def _set_payout_rule(conn: sqlite3.Connection, guild_id: int, role_id: int, amount: int | None) -> None:
+    if amount is None:
+        conn.execute("DELETE FROM payout_rules WHERE guild_id = ? AND role_id = ?", (guild_id, role_id))
+    else:
+        conn.execute("INSERT OR REPLACE INTO payout_rules (guild_id, role_id, amount) VALUES (?, ?, ?)", (guild_id, role_id, amount))
+
+def _payout_rules(conn: sqlite3.Connection, guild_id: int | None) -> list[tuple[int, int, int]]:
+    if guild_id is None:
+        return conn.execute("SELECT guild_id, role_id, amount FROM payout_rules").fetchall()
+    return conn.execute("SELECT guild_id, role_id, amount FROM payout_rules WHERE guild_id = ?", (guild_id,)).fetchall()
+
+def _pay_out(conn: sqlite3.Connection, guild_id: int, role_id: int, period: str, amount: int,
+             user_ids: list[int], reason: str) -> int | None:
+    """Credits every member in one transaction. Returns None if this payout already happened."""
+    now = int(time.time())
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("INSERT INTO payouts (guild_id, role_id, period, amount, paid_at) VALUES (?, ?, ?, ?, ?) "
+                     "ON CONFLICT DO NOTHING", (guild_id, role_id, period, amount, now))
+        if conn.execute("SELECT changes()").fetchone()[0] == 0:
+            conn.execute("ROLLBACK")
+            return None
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS payout_members (user_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM payout_members")
+        conn.executemany("INSERT OR IGNORE INTO payout_members (user_id) VALUES (?)", ((u,) for u in user_ids))
+        conn.execute("INSERT INTO balances (guild_id, user_id, balance) SELECT ?, user_id, ? FROM payout_members WHERE true "
+                     "ON CONFLICT (guild_id, user_id) DO UPDATE SET balance = balance + excluded.balance", (guild_id, amount))
+        paid = conn.execute("SELECT changes()").fetchone()[0]
+        conn.execute("INSERT INTO transactions (guild_id, user_id, amount, reason, created_at) "
+                     "SELECT ?, user_id, ?, ?, ? FROM payout_members", (guild_id, amount, reason, now))
+        conn.execute("UPDATE payouts SET members = ? WHERE guild_id = ? AND role_id = ? AND period = ?", (paid, guild_id, role_id, period))
+        conn.execute("COMMIT")
+        return paid
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+def _is_paid(conn: sqlite3.Connection, guild_id: int, role_id: int, period: str) -> bool:
+    return conn.execute("SELECT 1 FROM payouts WHERE guild_id = ? AND role_id = ? AND period = ?",
+                        (guild_id, role_id, period)).fetchone() is not None
+
+def _top(conn: sqlite3.Connection, guild_id: int, limit: int) -> list[tuple[int, int]]:
+    # Served by balances_leaderboard, no sort
+    return conn.execute("SELECT user_id, balance FROM balances WHERE guild_id = ? ORDER BY balance DESC LIMIT ?",
+                        (guild_id, limit)).fetchall()
+
+def format_amount(cents: int) -> str:
+    sign = "-" if cents < 0 else ""
+    return f"{sign}${abs(cents) // 100:,}.{abs(cents) % 100:02d}"
+
+class Ledger:
+    """Allowance balances in cents, kept in a SQLite database in WAL mode.
+
+    Every change is appended to the transactions table and added to the member's row in
+    balances. Changes are batched by a single writer thread, which owns the connection,
+    and committed in one transaction per batch, so the event loop never waits on the
+    disk. Balances are served from an LRU cache that is updated as changes are queued;
+    a miss is read on the writer thread after the queued changes are written."""
+
+    def __init__(self, path: Path = LEDGER_PATH, *, batch_delay: float = 0.05, max_cached: int = 100_000):
+        self.path = Path(path)
+        self.max_cached = max_cached
+        self._writer: BatchWriter[tuple[int, int, int, str | None, int]] = BatchWriter(
+            self._write_batch, name="ledger-writer", log=log, what="ledger changes", delay=batch_delay, retry_delay=RETRY_DELAY)
+        self._cache: OrderedDict[int, int] = OrderedDict()
+        self._reading: dict[int, bool] = {} # Uncached balances being read -> changed meanwhile
+        self._conn: sqlite3.Connection = self._writer.submit(self._connect).result()
+        self.write_stats = {"batches": 0, "rows": 0, "seconds": 0.0}
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _remember(self, key: int, balance: int) -> None:
+        self._cache[key] = balance
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def add(self, guild_id: int, user_id: int, amount: int, reason: str | None = None) -> int | None:
+        """Queues a change to a member's balance. Returns the new balance if it is cached."""
+        self._writer.add((guild_id, user_id, amount, reason, int(time.time())))
+        key = pack_key(guild_id, user_id)
+        balance = self._cache.get(key)
+        if balance is None:
+            if key in self._reading:
+                self._reading[key] = True
+            return None
+        self._remember(key, balance + amount)
+        return balance + amount
+
+    async def balance(self, guild_id: int, user_id: int) -> int:
+        key = pack_key(guild_id, user_id)
+        balance = self._cache.get(key)
+        if balance is not None:
+            self._cache.move_to_end(key)
+            return balance
+        self._reading.setdefault(key, False)
+        try:
+            balance = await asyncio.get_running_loop().run_in_executor(self._writer.executor, self._read_balance, guild_id, user_id)
+        finally:
+            # A change queued during the read may be missing from the result, so only
+            # cache it if there was none (concurrent readers of one key don't cache either)
+            changed = self._reading.pop(key, True)
+        if not changed and key not in self._cache:
+            self._remember(key, balance)
+        return balance
+
+    def _read_balance(self, guild_id: int, user_id: int) -> int:
+        self._writer.write_pending()
+        row = self._conn.execute(_SELECT_BALANCE, (guild_id, user_id)).fetchone()
+        return row[0] if row else 0
+
+    def _write_batch(self, batch: list[tuple[int, int, int, str | None, int]]) -> None:
+        deltas: dict[tuple[int, int], int] = {}
+        for guild_id, user_id, amount, _, _ in batch:
+            deltas[(guild_id, user_id)] = deltas.get((guild_id, user_id), 0) + amount
+        started = time.perf_counter()
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(_INSERT_TRANSACTION, batch)
+            self._conn.executemany(_ADD_BALANCE, [(g, u, amount) for (g, u), amount in deltas.items()])
+            self._conn.execute("COMMIT")
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+        self.write_stats["batches"] += 1
+        self.write_stats["rows"] += len(batch)
+        self.write_stats["seconds"] += time.perf_counter() - started
+
+    def run(self, fn, *args):
+        """Runs fn(connection, *args) on the writer thread, after the queued changes are written"""
+        def call():
+            self._writer.write_pending()
+            return fn(self._conn, *args)
+        return asyncio.get_running_loop().run_in_executor(self._writer.executor, call)
+
+    async def set_payout_rule(self, guild_id: int, role_id: int, amount: int | None) -> None:
+        """Sets (or with None, removes) the amount paid each period to a role, role 0 is everyone"""
+        await self.run(_set_payout_rule, guild_id, role_id, amount)
+
+    async def payout_rules(self, guild_id: int | None = None) -> list[tuple[int, int, int]]:
+        return await self.run(_payout_rules, guild_id)
+
+    async def pay_out(self, guild_id: int, role_id: int, period: str, amount: int, user_ids: list[int]) -> int | None:
+        """Credits `amount` to every member at once, at most once per (guild, role, period).
+        Returns how many were paid, or None if the period was already paid."""
+        paid = await self.run(_pay_out, guild_id, role_id, period, amount, user_ids, f"payout {period}")
+        if paid is not None:
+            for user_id in set(user_ids):
+                key = pack_key(guild_id, user_id)
+                if key in self._reading:
+                    self._reading[key] = True
+                if key in self._cache:
+                    self._cache[key] += amount
+        return paid
+
+    async def is_paid(self, guild_id: int, role_id: int, period: str) -> bool:
+        return await self.run(_is_paid, guild_id, role_id, period)
+
+    async def top(self, guild_id: int, limit: int = 10) -> list[tuple[int, int]]:
+        return await self.run(_top, guild_id, limit)
+
+    def invalidate(self, guild_id: int | None = None) -> None:
+        """Drops cached balances, e.g. after a bulk change made through run()"""
+        if guild_id is None:
+            self._cache.clear()
+        else:
+            for key in [k for k in self._cache if k >> 64 == guild_id]:
+                del self._cache[key]
+
+    def flush(self) -> None:
+        """Blocks until every queued change is committed. Raises sqlite3.Error if they
+        couldn't be, they stay queued for another try."""
+        if not self._writer.flush():
+            raise sqlite3.OperationalError(f"Ledger changes could not be written to {self.path}")
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._writer.submit(self._conn.close).result()
+            self._writer.shutdown()
@@ -0,0 +1,97 @@
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+# Every logger lives under "dadbot.<category>" so each category's level can be set on its own:
+#   DADBOT_LOG_LEVEL=INFO                       default level for every category
+#   DADBOT_LOG_LEVELS=messages=DEBUG,voice=WARNING
+#   DADBOT_MESSAGE_LOG_SAMPLE=0.01              fraction of "traffic" (one per message) records kept
+ROOT = "dadbot"
+CATEGORIES = ("traffic", "messages", "voice", "dm", "config", "money", "startup")
+FORMAT = "%(asctime)s %(levelname)-8s %(name)s: %(message)s"
+
+def get_logger(category: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT}.{category}")
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the records at or below `level`. Records above it always pass."""
+
+    def __init__(self, rate: float, level: int = logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > self.level or random.random() < self.rate
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves the log line to the listener thread. The message itself is
+    still merged with its args here, like the stock one does: args can be live objects
+    (members, guilds) that change or go away before the listener gets to them."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Same for tracebacks, the frames may be gone by then
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_listener: logging.handlers.QueueListener | None = None
+
+def _level(name: str, setting: str) -> int | None:
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        # getLevelName() hands back "Level X" for names it doesn't know
+        get_logger("startup").warning("Ignoring unknown log level %r in %s", name, setting)
+        return None
+    return level
+
+def _parse_levels(spec: str) -> dict[str, int]:
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        parsed = _level(level, f"DADBOT_LOG_LEVELS ({item})")
+        if parsed is not None:
+            levels[name.strip()] = parsed
+    return levels
+
+def setup_logging() -> None:
+    """Routes the bot's and discord.py's logging through a queue to a listener thread"""
+    global _listener
+    if _listener is not None:
+        return
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(FORMAT))
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+    handler = _DeferredQueueHandler(records)
+    for name in (ROOT, "discord"):
+        logger = logging.getLogger(name)
+        logger.handlers = [handler]
+        logger.propagate = False
+    default = _level(os.getenv("DADBOT_LOG_LEVEL", "INFO"), "DADBOT_LOG_LEVEL") or logging.INFO
+    for name in (ROOT, "discord"):
+        logging.getLogger(name).setLevel(default)
+
+    for category, level in _parse_levels(os.getenv("DADBOT_LOG_LEVELS", "")).items():
+        get_logger(category).setLevel(level)
+
+    rate = float(os.getenv("DADBOT_MESSAGE_LOG_SAMPLE", "0.01"))
+    if rate < 1:
+        get_logger("traffic").addFilter(SamplingFilter(rate))
+
+def shutdown_logging() -> None:
+    """Flushes queued records. Call before exiting."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
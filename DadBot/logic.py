@@ -1,86 +1,161 @@
-from datetime import datetime, time, timedelta
+from datetime import datetime
+from typing import Iterable
 from discord import Member
-import calendar
-from .config_manager import get_server_config, load_root
-from .config_models import QuietConfig
-
-
-def _is_day_enabled(quiet_days: str | None, dt: datetime) -> bool:
-    day = calendar.day_name[dt.weekday()]
-    if quiet_days is None:
-        quiet_days = ""
-    code = {"Monday":"M","Tuesday":"T","Wednesday":"W","Thursday":"R","Friday":"F","Saturday":"S","Sunday":"U"}[day]
-    return code in (quiet_days or "") 
-
-def _between(target: time, start: time | None, end: time | None) -> bool:
-    """Checks if the target time is located between the start and end times"""
-    if start is None:
-        start = time(0, 30)
-    if end is None:
-        end = time(7, 0)
-    if start <= end:
-        return (start <= target <= end)
+from .config_manager import add_change_listener, load_root
+from .config_models import QuietConfig, Overrides
+
+# Memo of merged effective configs: guild id -> (override-relevant role ids, user id) -> config.
+# The user id is None for members without a user override, so members that share
+# the same overridden roles share one entry. Entries for a guild are dropped whenever
+# config_manager reports a change to that guild.
+_resolved: dict[int, dict[tuple[frozenset[int], int | None], QuietConfig]] = {}
+# Compiled week tables, keyed like _resolved (None is the server config). The tables
+# themselves are shared through _tables, so identical effective configs share one.
+_compiled: dict[int, dict[tuple[frozenset[int], int | None] | None, "CompiledQuiet"]] = {}
+_tables: dict[tuple, "CompiledQuiet"] = {}
+_MAX_TABLES = 4096
+resolve_stats = {"hits": 0, "misses": 0}
+
+def _invalidate(guild_id: int | None) -> None:
+    if guild_id is None:
+        _resolved.clear()
+        _compiled.clear()
+        _tables.clear()
     else:
-        return (target >= start or target <= end)
-    
+        _resolved.pop(guild_id, None)
+        _compiled.pop(guild_id, None)
+
+add_change_listener(_invalidate)
+
+def _apply_override(target: QuietConfig, override: QuietConfig) -> None:
+    if override.start is not None:
+        target.start = override.start
+    if override.end is not None:
+        target.end = override.end
+    if override.grace is not None:
+        target.grace = override.grace
+    if override.days is not None:
+        target.days = override.days
+
+def _member_key(overrides: Overrides, member: Member) -> tuple[frozenset[int], int | None]:
+    role_ids = frozenset(role.id for role in member.roles if role.id in overrides.roles) if overrides.roles else frozenset()
+    return (role_ids, member.id if member.id in overrides.users else None)
+
 def resolve_config_for_member(guild_id: int, *, member: Member | None = None) -> QuietConfig:
+    """Returns the effective config for a member. The result is shared, do not mutate it."""
     root = load_root()
     guild_config = root.ensure_guild(guild_id)
     server_config = guild_config.server_config
 
     if member is None:
         return server_config
-    
-    return_config = QuietConfig(
-        start_time=server_config.start_time,
-        end_time=server_config.end_time,
-        quiet_days=server_config.quiet_days,
-        grace_period=server_config.grace_period
-    )
 
     overrides = guild_config.overrides
+    key = _member_key(overrides, member)
 
-    # Apply role overrides
-    for role in member.roles:
-        if role.id in overrides.roles:
-            role_config = overrides.roles[role.id]
-            if role_config.start_time is not None:
-                return_config.start_time = role_config.start_time
-            if role_config.end_time is not None:
-                return_config.end_time = role_config.end_time
-            if role_config.grace_period is not None:
-                return_config.grace_period = role_config.grace_period
-            if role_config.quiet_days is not None:
-                return_config.quiet_days = role_config.quiet_days
+    memo = _resolved.setdefault(guild_id, {})
+    cached = memo.get(key)
+    if cached is not None:
+        resolve_stats["hits"] += 1
+        return cached
+    resolve_stats["misses"] += 1
+
+    return_config = QuietConfig._make(server_config.start, server_config.end, server_config.days,
+                                      server_config.grace, server_config.holiday_ordinals)
+
+    # Apply role overrides, lowest role first so the highest role wins
+    roles = [role for role in member.roles if role.id in key[0]]
+    for role in sorted(roles, key=lambda r: (r.position, r.id)):
+        _apply_override(return_config, overrides.roles[role.id])
 
     # Apply user overrides
-    if member.id in overrides.users:
-        member_config = overrides.users[member.id]
-        if member_config.start_time is not None:
-            return_config.start_time = member_config.start_time
-        if member_config.end_time is not None:
-            return_config.end_time = member_config.end_time
-        if member_config.grace_period is not None:
-            return_config.grace_period = member_config.grace_period
-        if member_config.quiet_days is not None:
-            return_config.quiet_days = member_config.quiet_days
+    if key[1] is not None:
+        _apply_override(return_config, overrides.users[member.id])
 
+    memo[key] = return_config
     return return_config
 
+# Flags stored per minute of the week in CompiledQuiet.table. The *_AFTER flags hold the
+# answer for the rest of the minute after its first instant, which differs from the
+# first instant only at the (inclusive) end of a window.
+_QUIET, _QUIET_AFTER, _DC, _DC_AFTER = 1, 2, 4, 8
+
+def _window(start: int, end: int, flag: int, flag_after: int) -> bytearray:
+    """One day of flags for the window [start, end], both ends included, wrapping past midnight"""
+    day = bytearray(1440)
+    both = bytes([flag | flag_after])
+    if start <= end:
+        day[start:end + 1] = both * (end + 1 - start)
+    else:
+        day[start:] = both * (1440 - start)
+        day[:end + 1] = both * (end + 1)
+    day[end] = flag # Past end:00 the target is after the end time
+    return day
+
+class CompiledQuiet:
+    """A resolved config compiled into a 7x1440 table of flags, one byte per minute of the week"""
+    __slots__ = ("table",)
+
+    def __init__(self, config: QuietConfig):
+        start = 30 if config.start is None else config.start
+        end = 420 if config.end is None else config.end
+        grace_period = 30 if config.grace is None else config.grace
+        dc_start = (start + grace_period) % 1440
+
+        quiet = _window(start, end, _QUIET, _QUIET_AFTER)
+        dc = _window(dc_start, end, _DC, _DC_AFTER)
+        day = bytes(q | d for q, d in zip(quiet, dc))
+
+        self.table = bytearray(7 * 1440)
+        for weekday in range(7):
+            if config.days and config.days >> weekday & 1:
+                self.table[weekday * 1440:(weekday + 1) * 1440] = day
+
+    def flags(self, now: datetime) -> int:
+        return self.table[now.weekday() * 1440 + now.hour * 60 + now.minute]
+
+    def is_quiet(self, now: datetime) -> bool:
+        after = now.second or now.microsecond
+        return bool(self.flags(now) & (_QUIET_AFTER if after else _QUIET))
+
+    def is_dc(self, now: datetime) -> bool:
+        after = now.second or now.microsecond
+        return bool(self.flags(now) & (_DC_AFTER if after else _DC))
+
+def compiled_for_member(guild_id: int, *, member: Member | None = None) -> CompiledQuiet:
+    guild_config = load_root().ensure_guild(guild_id)
+    key = None if member is None else _member_key(guild_config.overrides, member)
+    memo = _compiled.setdefault(guild_id, {})
+    compiled = memo.get(key)
+    if compiled is None:
+        config = resolve_config_for_member(guild_id, member=member)
+        table_key = config._fields()
+        compiled = _tables.get(table_key)
+        if compiled is None:
+            if len(_tables) >= _MAX_TABLES:
+                _tables.clear() # Dropping tables still referenced from _compiled only costs sharing
+            compiled = _tables[table_key] = CompiledQuiet(config)
+        memo[key] = compiled
+    return compiled
+
 def is_quiet_time(guild_id: int, *, member: Member | None = None, now: datetime | None = None):
-    config = resolve_config_for_member(guild_id, member=member)
-    now = now or datetime.now()
-    if not _is_day_enabled(config.quiet_days, now):
-        return False
-    return _between(now.time(), config.start_time, config.end_time)
+    return compiled_for_member(guild_id, member=member).is_quiet(now or datetime.now())
 
 def is_dc_time(guild_id: int, *, member: Member | None = None, now: datetime | None = None):
-    config = resolve_config_for_member(guild_id, member=member)
+    return compiled_for_member(guild_id, member=member).is_dc(now or datetime.now())
+
+def members_in_dc_time(guild_id: int, members: Iterable[Member], *, now: datetime | None = None) -> list[Member]:
+    """Batch version of is_dc_time for a whole guild. Members are grouped by their
+    override key, so each distinct effective config is looked up only once."""
     now = now or datetime.now()
-    if not _is_day_enabled(config.quiet_days, now):
-        return False
-    
-    start = time(0,30) if config.start_time is None else config.start_time
-    grace_period = 30 if config.grace_period is None else config.grace_period
-    dc_time = (datetime.combine(now.date(), start) + timedelta(minutes=grace_period)).time()
-    return _between(now.time(), dc_time, config.end_time)
\ No newline at end of file
+    guild_config = load_root().ensure_guild(guild_id)
+    overrides = guild_config.overrides
+    groups: dict[tuple[frozenset[int], int | None], list[Member]] = {}
+    for member in members:
+        groups.setdefault(_member_key(overrides, member), []).append(member)
+
+    out: list[Member] = []
+    for group in groups.values():
+        if compiled_for_member(guild_id, member=group[0]).is_dc(now):
+            out.extend(group)
+    return out
@@ -1,55 +1,256 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
+import argparse
+import asyncio
 import os
+import signal
+import subprocess
+import sys
+import time
+from functools import partial
 from dotenv import load_dotenv
-import logging
 from pathlib import Path
-from DadBot.logic import is_dc_time, is_quiet_time
+from DadBot import config_manager
+from DadBot.config_manager import flush
+from DadBot.logic import is_quiet_time, members_in_dc_time
+from DadBot.scheduler import DisconnectScheduler
+from DadBot.disconnect import DisconnectExecutor, SweepStats
+from DadBot.presence import VoicePresence
+from DadBot.members import lean_cache_flags, register_gauges
+from DadBot.pipeline import pipeline_for
+from DadBot.log import get_logger, setup_logging, shutdown_logging
+from DadBot.metrics import handler_histogram, registry, start_http_server, timed
+from DadBot.profiling import profile_startup
 
-def make_bot() -> commands.Bot:
+log = get_logger("startup")
+voice_log = get_logger("voice")
+
+def make_bot(*, shard_id: int | None = None, shard_count: int | None = None, auto_shard: bool = False, lean: bool = False) -> commands.Bot:
+    """Builds the bot. auto_shard runs every shard (or shard_count shards) in this process,
+    shard_id/shard_count runs a single shard, for one process per shard. lean only caches
+    members in voice and doesn't request every member at startup."""
     intents = discord.Intents.default()
     intents.message_content = True
     intents.members = True
-    bot: commands.Bot = commands.Bot(command_prefix='$', description='Go to bed NOW.', intents=intents)
+    options = {}
+    if lean:
+        options = {"member_cache_flags": lean_cache_flags(), "chunk_guilds_at_startup": False}
+    # Bot owners can run process-wide commands like $parental profile. Defaults to the application's owner or team.
+    owner_ids = {int(i) for i in os.getenv("DADBOT_OWNER_IDS", "").split(",") if i.strip()}
+    if owner_ids:
+        options["owner_ids"] = owner_ids
+    bot: commands.Bot
+    if auto_shard:
+        bot = commands.AutoShardedBot(command_prefix='$', description='Go to bed NOW.', intents=intents, shard_count=shard_count, **options)
+    elif shard_id is not None:
+        bot = commands.Bot(command_prefix='$', description='Go to bed NOW.', intents=intents, shard_id=shard_id, shard_count=shard_count, **options)
+    else:
+        bot = commands.Bot(command_prefix='$', description='Go to bed NOW.', intents=intents, **options)
+    register_gauges(bot)
+    pipeline = pipeline_for(bot)
+
+    @bot.event
+    async def on_message(message):
+        await pipeline.dispatch(message)
+
     return bot
 
+EXTENSIONS = ("DadBot.cogs.parental", "DadBot.cogs.override", "DadBot.cogs.jokes", "DadBot.cogs.money")
+
 async def load_cogs(bot: commands.Bot):
-    await bot.load_extension("DadBot.cogs.parental")
-    await bot.load_extension("DadBot.cogs.override")
-    await bot.load_extension("DadBot.cogs.jokes")
-    await bot.load_extension("DadBot.cogs.money")
+    # In order: override attaches to the parental command group, or registers its own if
+    # parental isn't loaded yet. Pipeline stages are ordered explicitly.
+    for name in EXTENSIONS:
+        await bot.load_extension(name)
+
+class StartupTimer:
+    """Records how long each startup phase took, as a gauge and a log line"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def phase(self, name: str, since: float) -> None:
+        elapsed = time.perf_counter() - since
+        self.phases[name] = elapsed
+        registry.gauge("dadbot_startup_seconds", "Time spent in each startup phase", phase=name).set(elapsed)
+        log.info("Startup phase %s took %.3fs", name, elapsed)
 
-def main():
+async def end_call(bot: commands.Bot, disconnects: DisconnectExecutor, presence: VoicePresence, guild_id: int) -> SweepStats | None:
+    """Disconnects everyone in a guild's voice channels whose disconnect window is open"""
+    if not presence.count(guild_id):
+        return None
+    guild = bot.get_guild(guild_id)
+    if guild is None:
+        return None
+    members = members_in_dc_time(guild.id, presence.members(guild))
+    for member in members:
+        voice_log.info("Kicking %s from the #%s voice channel in %s", member, member.voice.channel, guild)
+    if not members:
+        return None
+    stats = await disconnects.sweep(members, reason="Quiet Time!")
+    voice_log.info("Disconnect sweep in %s: %s", guild, stats)
+    handler_histogram("end_call").observe(stats.wall_time)
+    registry.counter("dadbot_disconnects_total", "Members disconnected by sweeps", outcome="kicked").inc(stats.kicked)
+    registry.counter("dadbot_disconnects_total", "Members disconnected by sweeps", outcome="failed").inc(stats.failed)
+    return stats
+
+async def handle_voice_state(presence: VoicePresence, disconnects: DisconnectExecutor, member: discord.Member,
+                             before: discord.VoiceState, after: discord.VoiceState) -> None:
+    """Keeps the presence index current and disconnects members who join during quiet time"""
+    presence.update(member, before, after)
+    if after.channel is not None and before.channel != after.channel:
+        voice_log.debug("%s joined %s", member, after.channel.name)
+        if is_quiet_time(after.channel.guild.id, member=member):
+            disconnects.submit(member, reason="Quiet Time!")
+
+def _env_int(name: str) -> int | None:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Go to bed NOW.")
+    parser.add_argument("--auto-shard", action="store_true", default=os.getenv("DADBOT_AUTO_SHARD") == "1",
+                        help="run all shards in this process (DADBOT_AUTO_SHARD=1)")
+    parser.add_argument("--shard-id", type=int, default=_env_int("DADBOT_SHARD_ID"),
+                        help="run only this shard (DADBOT_SHARD_ID)")
+    parser.add_argument("--shard-count", type=int, default=_env_int("DADBOT_SHARD_COUNT"),
+                        help="total number of shards (DADBOT_SHARD_COUNT)")
+    parser.add_argument("--lean-members", action="store_true", default=os.getenv("DADBOT_LEAN_MEMBERS") == "1",
+                        help="only cache members in voice, fetch others' roles when needed (DADBOT_LEAN_MEMBERS=1)")
+    parser.add_argument("--processes", type=int, metavar="N",
+                        help="start N shards, each in its own process, sharing the config store")
+    args = parser.parse_args(argv)
+    if args.shard_id is not None and args.shard_count is None:
+        parser.error("--shard-id needs --shard-count")
+    return args
+
+def _spawn_shards(count: int, *, lean: bool = False) -> int:
+    """Runs one child process per shard with the same options and waits for all of them"""
+    if config_manager.CONFIG_BACKEND != "sqlite":
+        log.warning("Shard processes share config.json; set DADBOT_CONFIG_BACKEND=sqlite so their writes don't collide")
+    argv = [sys.executable, "-m", "DadBot.main"]
+    if lean:
+        argv.append("--lean-members")
+    children = []
+    for shard_id in range(count):
+        env = dict(os.environ, DADBOT_SHARD_ID=str(shard_id), DADBOT_SHARD_COUNT=str(count), DADBOT_AUTO_SHARD="0")
+        children.append(subprocess.Popen(argv, env=env))
+        log.info("Started shard %d/%d as pid %d", shard_id, count, children[-1].pid)
+
+    def forward(signum, frame):
+        for child in children:
+            child.send_signal(signum)
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    return max(child.wait() for child in children)
+
+def main(argv: list[str] | None = None):
     load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+    setup_logging()
+    args = _parse_args(argv)
+    if args.processes:
+        try:
+            sys.exit(_spawn_shards(args.processes, lean=args.lean_members))
+        finally:
+            shutdown_logging()
     TOKEN = os.getenv("DISCORD_TOKEN")
     if TOKEN is None:
-        print("ERROR: No authentication token")
+        log.error("No authentication token")
         return
-    bot = make_bot()
+    bot = make_bot(shard_id=args.shard_id, shard_count=args.shard_count, auto_shard=args.auto_shard, lean=args.lean_members)
     
-    @tasks.loop(minutes=1)
-    async def end_call():
-        for guild in bot.guilds:
-            for vc in guild.voice_channels:
-                for member in vc.members:
-                    if (is_dc_time(guild.id, member=member)):
-                        print(f"Kicking {member} from the #{vc} voice channel in {guild}")
-                        await member.move_to(None)
+    # One scheduler per shard, so each shard's sweeps only cover its own guilds
+    disconnects = DisconnectExecutor()
+    presence = VoicePresence()
+    registry.gauge("dadbot_voice_members", "Members connected to voice", fn=lambda: len(presence))
+    schedulers: dict[int, DisconnectScheduler] = {}
+    registry.gauge("dadbot_scheduled_guilds", "Guilds with a pending disconnect transition",
+                   fn=lambda: sum(len(s.pending) for s in schedulers.values()))
+    startup = StartupTimer()
+    metrics_server = None
+    background: set[asyncio.Task] = set()
+
+    def scheduler_for(guild: discord.Guild) -> DisconnectScheduler:
+        shard_id = guild.shard_id or 0
+        scheduler = schedulers.get(shard_id)
+        if scheduler is None:
+            scheduler = schedulers[shard_id] = DisconnectScheduler(partial(end_call, bot, disconnects, presence))
+            scheduler.start()
+        return scheduler
+
+    async def setup_hook():
+        """Runs once, after login and before the gateway connects"""
+        nonlocal metrics_server
+        profiling = asyncio.create_task(profile_startup()) # DADBOT_PROFILE=<seconds>
+        background.add(profiling)
+        profiling.add_done_callback(background.discard)
+
+        started = time.perf_counter()
+        await asyncio.to_thread(config_manager.load_root) # Read and index the config before events arrive
+        startup.phase("config", started)
+
+        started = time.perf_counter()
+        await load_cogs(bot)
+        startup.phase("cogs", started)
+
+        started = time.perf_counter()
+        metrics_server = await start_http_server()
+        disconnects.start()
+        startup.phase("tasks", started)
+    bot.setup_hook = setup_hook # type: ignore[method-assign]
+
+    close_bot = bot.close
+    async def close():
+        """Stops what setup_hook started, then logs out"""
+        for scheduler in schedulers.values():
+            scheduler.stop()
+        await disconnects.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+        await close_bot()
+    bot.close = close # type: ignore[method-assign]
 
     @bot.event
     async def on_ready():
-        print(f'We have logged in as {bot.user}')
-        await load_cogs(bot)
-        end_call.start()
+        # Fires again after reconnects that couldn't resume, so only refresh per-connection state here
+        log.info("We have logged in as %s", bot.user)
+        if "ready" not in startup.phases:
+            startup.phase("ready", startup.started)
+        started = time.perf_counter()
+        presence.rebuild(bot.guilds)
+        for guild in bot.guilds:
+            scheduler_for(guild).add_guild(guild.id)
+        voice_log.debug("Refreshed voice presence and schedules in %.3fs", time.perf_counter() - started)
+
+    @bot.event
+    async def on_resumed():
+        # Voice updates may have been missed while disconnected
+        presence.rebuild(bot.guilds)
+
+    @bot.event
+    async def on_guild_join(guild):
+        presence.rebuild_guild(guild)
+        scheduler_for(guild).add_guild(guild.id)
+
+    @bot.event
+    async def on_guild_remove(guild):
+        presence.remove_guild(guild.id)
+        scheduler_for(guild).remove_guild(guild.id)
 
     @bot.event
+    @timed("on_voice_state_update")
     async def on_voice_state_update(member, before, after):
-        if after.channel is not None and before.channel != after.channel:
-            print(f"{member} joined {after.channel.name}")
-            if is_quiet_time(after.channel.guild.id, member=member):
-                await member.move_to(None, reason="Quiet Time!")
+        await handle_voice_state(presence, disconnects, member, before, after)
 
-    bot.run(TOKEN)
+    try:
+        bot.run(TOKEN, log_handler=None)
+    finally:
+        try:
+            flush()
+        finally:
+            shutdown_logging()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sys
+import time
+from collections import OrderedDict
+import discord
+from .log import get_logger
+from .metrics import registry, track_call
+
+log = get_logger("startup")
+
+def lean_cache_flags() -> discord.MemberCacheFlags:
+    """Only keep members who are in voice. Everyone else arrives with their roles on the
+    message or typing payload, or is fetched by MemberResolver."""
+    flags = discord.MemberCacheFlags.none()
+    flags.voice = True
+    return flags
+
+class MemberResolver:
+    """Turns a user seen in a guild into a Member with roles, when the cache doesn't have it.
+
+    Fetched members (and misses) are kept for `ttl` seconds in a small LRU, so someone
+    typing repeatedly costs one API call per ttl. Concurrent lookups share one fetch."""
+
+    def __init__(self, ttl: float = 10 * 60, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[int, int], tuple[float, discord.Member | None]] = OrderedDict()
+        self._fetching: dict[tuple[int, int], asyncio.Future] = {}
+        self.stats = {"cached": 0, "hits": 0, "fetches": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def resolve(self, guild: discord.Guild, user: discord.User | discord.Member) -> discord.Member | None:
+        if isinstance(user, discord.Member):
+            return user
+        member = guild.get_member(user.id)
+        if member is not None:
+            self.stats["cached"] += 1
+            return member
+
+        key = (guild.id, user.id)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+        pending = self._fetching.get(key)
+        if pending is not None:
+            return await pending
+        future = self._fetching[key] = asyncio.get_running_loop().create_future()
+        try:
+            self.stats["fetches"] += 1
+            try:
+                member = await track_call("fetch_member", guild.fetch_member(user.id))
+            except discord.NotFound:
+                member = None
+            self._entries[key] = (time.monotonic() + self.ttl, member)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            future.set_result(member)
+            return member
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Retrieved here, waiters get it too
+            raise
+        finally:
+            del self._fetching[key]
+
+def process_rss() -> int:
+    """Resident memory of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+def guild_memory(guild: discord.Guild, sample: int = 200) -> dict[str, int]:
+    """Rough size of what the cache holds for a guild. Member size is estimated from a sample."""
+    members = guild.members
+    sampled = members[:sample]
+    per_member = (sum(sys.getsizeof(m) + sys.getsizeof(getattr(m, "_roles", ())) for m in sampled) / len(sampled)) if sampled else 0
+    return {
+        "members": len(members),
+        "member_count": guild.member_count or 0,
+        "roles": len(guild.roles),
+        "channels": len(guild.channels),
+        "member_bytes": int(per_member * len(members)),
+    }
+
+def register_gauges(bot: discord.Client) -> None:
+    registry.gauge("dadbot_process_rss_bytes", "Resident memory of the bot process", fn=process_rss)
+    registry.gauge("dadbot_cached_members", "Members held in the member cache", fn=lambda: sum(len(g.members) for g in bot.guilds))
@@ -0,0 +1,235 @@
+import asyncio
+import functools
+import os
+import time
+from bisect import bisect_left
+from typing import Awaitable, Callable, TypeVar
+import discord
+from . import config_manager, logic
+from .log import get_logger
+
+log = get_logger("startup")
+
+T = TypeVar("T")
+
+# Latency buckets in seconds, from 100us to 10s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = tuple[tuple[str, str], ...]
+
+def _format_labels(labels: Labels, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+class Counter:
+    """Only goes up. With fn, it reports a running total kept elsewhere."""
+    __slots__ = ("_value", "fn")
+
+    def __init__(self, fn: Callable[[], float] | None = None):
+        self._value = 0
+        self.fn = fn
+
+    def inc(self, amount: int = 1) -> None:
+        self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self.fn() if self.fn is not None else self._value
+
+class Gauge:
+    __slots__ = ("value", "fn")
+
+    def __init__(self, fn: Callable[[], float] | None = None):
+        self.value = 0.0
+        self.fn = fn
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def get(self) -> float:
+        return self.fn() if self.fn is not None else self.value
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+class Registry:
+    """Metric families by name, each holding one metric per label set"""
+
+    def __init__(self):
+        self._families: dict[str, tuple[str, str, dict[Labels, Counter | Gauge | Histogram]]] = {}
+
+    def _get(self, kind: str, name: str, help: str, labels: dict[str, str], factory: Callable[[], T]) -> T:
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help, {})
+        key = tuple(sorted(labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = factory() # type: ignore
+        return metric # type: ignore
+
+    def counter(self, name: str, help: str = "", fn: Callable[[], float] | None = None, **labels: str) -> Counter:
+        counter = self._get("counter", name, help, labels, lambda: Counter(fn))
+        if fn is not None:
+            counter.fn = fn
+        return counter
+
+    def gauge(self, name: str, help: str = "", fn: Callable[[], float] | None = None, **labels: str) -> Gauge:
+        gauge = self._get("gauge", name, help, labels, lambda: Gauge(fn))
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help: str = "", buckets: tuple[float, ...] = DEFAULT_BUCKETS, **labels: str) -> Histogram:
+        return self._get("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def family(self, name: str) -> dict[Labels, Counter | Gauge | Histogram]:
+        return self._families.get(name, ("", "", {}))[2]
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for name, (kind, help, metrics) in sorted(self._families.items()):
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics.items():
+                if isinstance(metric, Counter):
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+                elif isinstance(metric, Gauge):
+                    lines.append(f"{name}{_format_labels(labels)} {metric.get()}")
+                else:
+                    cumulative = 0
+                    for bound, n in zip(metric.buckets + (float("inf"),), metric.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+registry.counter("dadbot_config_cache_hits_total", "load_root() calls answered from the cache", fn=lambda: config_manager.cache_stats["hits"])
+registry.counter("dadbot_config_cache_misses_total", "load_root() calls that read the store", fn=lambda: config_manager.cache_stats["misses"])
+registry.counter("dadbot_config_load_seconds_total", "Time spent reading the store", fn=lambda: config_manager.cache_stats["load_seconds"])
+registry.counter("dadbot_config_saves_total", "Changes handed to the store", fn=lambda: config_manager.save_stats["count"])
+registry.counter("dadbot_config_save_seconds_total", "Time spent handing changes to the store", fn=lambda: config_manager.save_stats["seconds"])
+registry.counter("dadbot_resolve_cache_hits_total", "Effective config resolutions answered from the memo", fn=lambda: logic.resolve_stats["hits"])
+registry.counter("dadbot_resolve_cache_misses_total", "Effective config resolutions that merged overrides", fn=lambda: logic.resolve_stats["misses"])
+
+def summary() -> list[str]:
+    """Short human-readable digest of the registry, for the stats command"""
+    lines = []
+    for labels, metric in sorted(registry.family("dadbot_handler_seconds").items()):
+        assert isinstance(metric, Histogram)
+        lines.append(f"• {dict(labels)['handler']}: {metric.count} calls, mean {metric.mean * 1000:.2f} ms, "
+                     f"p99 <= {metric.quantile(0.99) * 1000:g} ms")
+    calls: dict[str, dict[str, int]] = {}
+    for labels, metric in registry.family("dadbot_discord_calls_total").items():
+        assert isinstance(metric, Counter)
+        d = dict(labels)
+        calls.setdefault(d["call"], {})[d["outcome"]] = metric.value
+    for call, outcomes in sorted(calls.items()):
+        lines.append(f"• {call}: " + ", ".join(f"{n} {outcome}" for outcome, n in sorted(outcomes.items())))
+    for name, label in (("config_cache", "config cache"), ("resolve_cache", "resolve cache")):
+        hits = registry.counter(f"dadbot_{name}_hits_total").value
+        misses = registry.counter(f"dadbot_{name}_misses_total").value
+        total = hits + misses
+        lines.append(f"• {label}: {hits} hits, {misses} misses" + (f" ({hits / total:.1%} hit rate)" if total else ""))
+    return lines
+
+def handler_histogram(handler: str) -> Histogram:
+    return registry.histogram("dadbot_handler_seconds", "Time spent in event handlers", handler=handler)
+
+def timed(handler: str):
+    """Decorator recording an async handler's run time"""
+    histogram = handler_histogram(handler)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+async def track_call(call: str, awaitable: Awaitable[T]) -> T:
+    """Awaits an outbound Discord API call, counting it by outcome and timing it"""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        return await awaitable
+    except discord.Forbidden:
+        outcome = "forbidden"
+        raise
+    except discord.HTTPException as e:
+        outcome = "rate_limited" if e.status == 429 else "error"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        registry.counter("dadbot_discord_calls_total", "Outbound Discord API calls", call=call, outcome=outcome).inc()
+        registry.histogram("dadbot_discord_call_seconds", "Outbound Discord API call latency", call=call).observe(time.perf_counter() - started)
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_http_server(port: int | None = None, host: str = "127.0.0.1") -> asyncio.AbstractServer | None:
+    """Serves /metrics on a local port. Off unless a port is given or DADBOT_METRICS_PORT is set."""
+    if port is None:
+        port_env = os.getenv("DADBOT_METRICS_PORT")
+        if not port_env:
+            return None
+        port = int(port_env)
+    server = await asyncio.start_server(_serve, host, port)
+    log.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+import discord
+from .log import get_logger
+from .metrics import registry, track_call
+
+log = get_logger("dm")
+
+# Discord rejects message content longer than this
+MAX_CONTENT = 2000
+
+def _count(outcome: str) -> None:
+    registry.counter("dadbot_dm_outbox_total", "Direct messages handed to the outbox", outcome=outcome).inc()
+
+def _split(content: str) -> list[str]:
+    """Cuts content into pieces Discord accepts, at a line break where there is one"""
+    chunks = []
+    while len(content) > MAX_CONTENT:
+        cut = content.rfind("\n", MAX_CONTENT // 2, MAX_CONTENT)
+        if cut == -1:
+            cut = MAX_CONTENT
+        chunks.append(content[:cut])
+        content = content[cut:].lstrip("\n")
+    chunks.append(content)
+    return chunks
+
+@dataclass
+class _Notice:
+    user: discord.User | discord.Member
+    kind: str
+    parts: list[str] = field(default_factory=list)
+    attempts: int = 0
+
+    @property
+    def content(self) -> str:
+        return "\n\n".join(self.parts)
+
+class TokenBucket:
+    """Allows `rate` operations per second on average, in bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Takes a token and returns how long to wait before using it"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+class DMOutbox:
+    """Sends quiet-time notices in the background.
+
+    Notices are keyed by (user, kind). While one is waiting to be sent, later notices of
+    the same key are merged into it (append=True, in a follow-up DM once it is full) or
+    dropped, and once sent, the key is
+    quiet for `window` seconds. Sends share a token bucket sized to the DM budget, 429s
+    are retried after the advertised delay, and users whose DMs are closed are skipped
+    for `closed_ttl` seconds instead of being retried."""
+
+    def __init__(self, rate: float = 2.0, burst: int = 5, max_retries: int = 3, closed_ttl: float = 6 * 60 * 60):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.closed_ttl = closed_ttl
+        self._queue: deque[_Notice] = deque()
+        self._pending: dict[tuple[int, str], _Notice] = {}
+        self._quiet_until: dict[tuple[int, str], float] = {}
+        self._closed: dict[int, float] = {}
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def is_closed(self, user_id: int) -> bool:
+        until = self._closed.get(user_id)
+        if until is None:
+            return False
+        if time.monotonic() >= until:
+            del self._closed[user_id]
+            return False
+        return True
+
+    def send(self, user: discord.User | discord.Member, content: str, *, kind: str = "notice", window: float = 0.0, append: bool = False) -> bool:
+        """Queues a DM. Returns False if it was merged, suppressed, or the user's DMs are closed.
+        Content too long for one DM is split when appending and truncated otherwise."""
+        if self.is_closed(user.id):
+            _count("closed")
+            return False
+        key = (user.id, kind)
+        chunks = _split(content) if append else [content if len(content) <= MAX_CONTENT else content[:MAX_CONTENT - 1] + "…"]
+        pending = self._pending.get(key)
+        if pending is not None:
+            if not append:
+                _count("coalesced")
+                return False
+            if len(pending.content) + len(chunks[0]) + 2 <= MAX_CONTENT:
+                pending.parts.append(chunks.pop(0))
+                _count("coalesced")
+            if not chunks:
+                return False
+        else:
+            now = time.monotonic()
+            if self._quiet_until.get(key, 0.0) > now:
+                _count("suppressed")
+                return False
+            if window:
+                self._quiet_until[key] = now + window
+                if len(self._quiet_until) > 4096:
+                    self._prune(now)
+
+        for chunk in chunks: # The last one takes further appends
+            notice = self._pending[key] = _Notice(user, kind, [chunk])
+            self._queue.append(notice)
+            _count("queued")
+        self.start()
+        assert self._wake is not None
+        self._wake.set()
+        return True
+
+    def _prune(self, now: float) -> None:
+        self._quiet_until = {key: until for key, until in self._quiet_until.items() if until > now}
+        self._closed = {user_id: until for user_id, until in self._closed.items() if until > now}
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            if not self._queue:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            delay = self.bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            notice = self._queue.popleft()
+            key = (notice.user.id, notice.kind)
+            if self._pending.get(key) is notice:
+                del self._pending[key]
+            try:
+                await self._deliver(notice)
+            except Exception:
+                log.exception("Failed to DM %s", notice.user)
+                _count("failed")
+
+    async def _deliver(self, notice: _Notice) -> None:
+        try:
+            await track_call("dm", notice.user.send(notice.content))
+            _count("sent")
+        except discord.Forbidden:
+            self._closed[notice.user.id] = time.monotonic() + self.closed_ttl
+            log.info("DMs closed for %s, skipping them for %d minutes", notice.user, self.closed_ttl // 60)
+            _count("closed")
+        except discord.HTTPException as e:
+            if e.status != 429 and e.status < 500 or notice.attempts >= self.max_retries:
+                log.warning("Failed to DM %s: %s", notice.user, e)
+                _count("failed")
+                return
+            notice.attempts += 1
+            retry_after = getattr(e, "retry_after", None) or min(2 ** notice.attempts, 30)
+            await asyncio.sleep(retry_after) # The whole DM budget is blocked, so hold the queue
+            self._pending.setdefault((notice.user.id, notice.kind), notice)
+            self._queue.appendleft(notice)
@@ -0,0 +1,118 @@
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+import discord
+from discord.ext import commands
+from .log import get_logger
+from .metrics import Histogram, handler_histogram, registry
+
+log = get_logger("messages")
+
+@dataclass
+class MessageState:
+    """What the pipeline knows about a message, shared by every stage"""
+    message: discord.Message
+    ctx: commands.Context | None = None # Only built when the message starts with a prefix
+
+    @property
+    def is_command(self) -> bool:
+        return self.ctx is not None and self.ctx.valid
+
+# A stage returns False to stop the pipeline for this message
+Stage = Callable[[MessageState], Awaitable[bool | None]]
+
+@dataclass
+class StageTiming:
+    histogram: Histogram
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, elapsed: float) -> None:
+        self.histogram.observe(elapsed)
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+COMMANDS_ORDER = 1000
+
+def _stage_timing(name: str) -> StageTiming:
+    return StageTiming(registry.histogram("dadbot_message_stage_seconds", "Time spent in each message pipeline stage", stage=name))
+
+class MessagePipeline:
+    """Runs every guild message through the registered stages in order, then dispatches
+    it as a command exactly once. Replaces the per-cog on_message listeners."""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self._stages: list[tuple[int, str, Stage]] = [(COMMANDS_ORDER, "commands", self._invoke)]
+        self.timings: dict[str, StageTiming] = {"prefilter": _stage_timing("prefilter"), "commands": _stage_timing("commands")}
+        self._histogram = handler_histogram("on_message")
+
+    @property
+    def stages(self) -> list[str]:
+        return [name for _, name, _ in self._stages]
+
+    def add_stage(self, name: str, stage: Stage, *, order: int) -> None:
+        self.remove_stage(name)
+        self._stages.append((order, name, stage))
+        self._stages.sort(key=lambda s: s[0])
+        if name not in self.timings:
+            self.timings[name] = _stage_timing(name)
+
+    def remove_stage(self, name: str) -> None:
+        self._stages = [s for s in self._stages if s[1] != name]
+
+    async def _prefilter(self, message: discord.Message) -> MessageState | None:
+        if message.author.bot or message.author == self.bot.user or message.guild is None:
+            return None
+        state = MessageState(message)
+        prefix = await self.bot.get_prefix(message)
+        prefixes = (prefix,) if isinstance(prefix, str) else tuple(prefix)
+        if (message.content or "").startswith(prefixes):
+            state.ctx = await self.bot.get_context(message)
+        return state
+
+    async def _invoke(self, state: MessageState) -> None:
+        if state.ctx is not None:
+            await self.bot.invoke(state.ctx)
+
+    async def dispatch(self, message: discord.Message) -> None:
+        started = time.perf_counter()
+        try:
+            await self._run(message, started)
+        finally:
+            self._histogram.observe(time.perf_counter() - started)
+
+    async def _run(self, message: discord.Message, started: float) -> None:
+        state = await self._prefilter(message)
+        now = time.perf_counter()
+        self.timings["prefilter"].add(now - started)
+        if state is None:
+            return
+
+        for _, name, stage in self._stages:
+            started = now
+            try:
+                keep_going = await stage(state)
+            except Exception:
+                log.exception("Message stage %s failed", name)
+                keep_going = None
+            now = time.perf_counter()
+            self.timings[name].add(now - started)
+            if keep_going is False:
+                return
+
+_pipelines: "weakref.WeakKeyDictionary[commands.Bot, MessagePipeline]" = weakref.WeakKeyDictionary()
+
+def pipeline_for(bot: commands.Bot) -> MessagePipeline:
+    pipeline = _pipelines.get(bot)
+    if pipeline is None:
+        pipeline = _pipelines[bot] = MessagePipeline(bot)
+    return pipeline
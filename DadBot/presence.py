@@ -0,0 +1,74 @@
+from typing import Iterable
+import discord
+from .log import get_logger
+
+log = get_logger("voice")
+
+class VoicePresence:
+    """Who is connected to voice in each guild, as guild id -> {member id: channel id}.
+
+    Kept current from voice state updates and rebuilt from the cache on ready and resume,
+    so a sweep only looks at connected members and a guild with nobody in voice costs
+    a single dict lookup."""
+
+    def __init__(self):
+        self._guilds: dict[int, dict[int, int]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(members) for members in self._guilds.values())
+
+    def count(self, guild_id: int) -> int:
+        members = self._guilds.get(guild_id)
+        return len(members) if members else 0
+
+    def channel_of(self, guild_id: int, member_id: int) -> int | None:
+        members = self._guilds.get(guild_id)
+        return members.get(member_id) if members else None
+
+    def _set(self, guild_id: int, member_id: int, channel_id: int | None) -> None:
+        if channel_id is None:
+            members = self._guilds.get(guild_id)
+            if members is not None:
+                members.pop(member_id, None)
+                if not members:
+                    del self._guilds[guild_id]
+        else:
+            self._guilds.setdefault(guild_id, {})[member_id] = channel_id
+
+    def update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> None:
+        """Applies one voice state update"""
+        if before.channel == after.channel:
+            return
+        self._set(member.guild.id, member.id, None if after.channel is None else after.channel.id)
+
+    def rebuild_guild(self, guild: discord.Guild) -> int:
+        """Replaces a guild's entries with what the voice channels hold right now"""
+        members = {member.id: vc.id for vc in guild.voice_channels for member in vc.members}
+        if members:
+            self._guilds[guild.id] = members
+        else:
+            self._guilds.pop(guild.id, None)
+        return len(members)
+
+    def rebuild(self, guilds: Iterable[discord.Guild]) -> int:
+        total = sum(self.rebuild_guild(guild) for guild in guilds)
+        log.info("Voice presence rebuilt: %d members in voice across %d guilds", total, len(self._guilds))
+        return total
+
+    def remove_guild(self, guild_id: int) -> None:
+        self._guilds.pop(guild_id, None)
+
+    def members(self, guild: discord.Guild) -> list[discord.Member]:
+        """The guild's connected members. Entries whose member has left voice or the cache
+        since the last update are dropped on the way."""
+        ids = self._guilds.get(guild.id)
+        if not ids:
+            return []
+        out = []
+        for member_id in list(ids):
+            member = guild.get_member(member_id)
+            if member is None or member.voice is None or member.voice.channel is None:
+                self._set(guild.id, member_id, None)
+            else:
+                out.append(member)
+        return out
@@ -0,0 +1,141 @@
+import asyncio
+import cProfile
+import linecache
+import logging
+import os
+import pstats
+import re
+import time
+import traceback
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from .log import get_logger
+
+log = get_logger("startup")
+
+PROFILE_DIR = Path(__file__).resolve().parent.parent / "profiles"
+_PACKAGE_DIR = str(Path(__file__).resolve().parent)
+# Loop callbacks slower than this are reported while profiling
+SLOW_CALLBACK_SECONDS = 0.05
+
+_active = False
+
+@dataclass
+class ProfileReport:
+    started: float
+    seconds: float
+    stats_path: Path
+    report_path: Path
+    summary: list[str] = field(default_factory=list)
+
+class _SlowCallbacks(logging.Handler):
+    """Collects asyncio's debug-mode "Executing <Handle ...> took N seconds" warnings"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.lines: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if "took" in message:
+            self.lines.append(message)
+
+def _short(func: tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename.startswith(_PACKAGE_DIR):
+        filename = "DadBot" + filename[len(_PACKAGE_DIR):]
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{line}({name})" if name else f"{filename}:{line}"
+
+# Absolute paths in asyncio's handle reprs ("created at /home/.../file.py:12")
+_PATH = re.compile(r"(?:[A-Za-z]:)?[\\/](?:[^\s\\/:'\"<>]+[\\/])+([^\s\\/:'\"<>]+)")
+
+def _strip_paths(line: str) -> str:
+    """Keeps only file names, the summary is posted in Discord"""
+    return _PATH.sub(r"\1", line)
+
+def _cpu_summary(stats: pstats.Stats, top: int) -> list[str]:
+    entries = stats.stats.items() # type: ignore[attr-defined]
+    lines = ["Own time:"]
+    for func, (_, calls, own, total, _) in sorted(entries, key=lambda e: e[1][2], reverse=True)[:top]:
+        lines.append(f"  {own * 1000:9.1f} ms {calls:8d} calls  {_short(func)}")
+    lines.append("DadBot, cumulative:")
+    ours = [e for e in entries if e[0][0].startswith(_PACKAGE_DIR)]
+    for func, (_, calls, own, total, _) in sorted(ours, key=lambda e: e[1][3], reverse=True)[:top]:
+        lines.append(f"  {total * 1000:9.1f} ms {calls:8d} calls  {_short(func)}")
+    return lines
+
+# Allocations made by the profiling itself (debug mode keeps a traceback per handle)
+_OWN_ALLOCATIONS = tuple(tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, linecache, traceback)) # type: ignore[arg-type]
+
+def _memory_summary(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top: int) -> list[str]:
+    lines = ["Memory growth:"]
+    before, after = before.filter_traces(_OWN_ALLOCATIONS), after.filter_traces(_OWN_ALLOCATIONS)
+    for diff in after.compare_to(before, "lineno")[:top]:
+        frame = diff.traceback[0]
+        lines.append(f"  {diff.size_diff / 1024:+9.1f} KiB {diff.count_diff:+8d} blocks  "
+                     f"{_short((frame.filename, frame.lineno, ''))}")
+    return lines
+
+def _write(report: ProfileReport, profile: cProfile.Profile, lines: list[str]) -> None:
+    report.stats_path.parent.mkdir(parents=True, exist_ok=True)
+    profile.dump_stats(report.stats_path)
+    report.report_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+def is_profiling() -> bool:
+    return _active
+
+async def profile_for(seconds: float, *, top: int = 10, directory: Path = PROFILE_DIR) -> ProfileReport:
+    """Profiles everything the event loop runs for `seconds`: CPU with cProfile, memory
+    growth with tracemalloc and slow callbacks with asyncio debug mode.
+
+    Writes <timestamp>.prof (pstats, e.g. for snakeviz) and <timestamp>.txt to `directory`.
+    Nothing is hooked outside the window, so it costs nothing while off."""
+    global _active
+    if _active:
+        raise RuntimeError("A profile is already running")
+    _active = True
+    loop = asyncio.get_running_loop()
+    slow = _SlowCallbacks()
+    asyncio_log = logging.getLogger("asyncio")
+    previous = (loop.get_debug(), loop.slow_callback_duration)
+    started_tracing = not tracemalloc.is_tracing()
+    profile = cProfile.Profile()
+    started = time.time()
+    try:
+        if started_tracing:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        asyncio_log.addHandler(slow)
+        loop.set_debug(True)
+        loop.slow_callback_duration = SLOW_CALLBACK_SECONDS
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            loop.set_debug(previous[0])
+            loop.slow_callback_duration = previous[1]
+            asyncio_log.removeHandler(slow)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _active = False
+
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+    report = ProfileReport(started, seconds, directory / f"{stamp}.prof", directory / f"{stamp}.txt")
+    report.summary = _cpu_summary(pstats.Stats(profile), top) + _memory_summary(before, after, top)
+    report.summary.append(f"Slow callbacks (> {SLOW_CALLBACK_SECONDS * 1000:g} ms): {len(slow.lines)}")
+    report.summary += [f"  {_strip_paths(line)[:200]}" for line in slow.lines[:top]]
+    await asyncio.to_thread(_write, report, profile, report.summary + slow.lines[top:])
+    log.info("Profiled %gs, wrote %s and %s", seconds, report.stats_path, report.report_path)
+    return report
+
+async def profile_startup() -> None:
+    """Profiles the first DADBOT_PROFILE seconds after startup, if it is set"""
+    seconds = float(os.getenv("DADBOT_PROFILE") or 0)
+    if seconds > 0:
+        await profile_for(seconds)
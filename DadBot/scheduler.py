@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from .config_manager import add_change_listener, remove_change_listener, load_root
+from .config_models import GuildConfig, QuietConfig
+from .log import get_logger
+
+log = get_logger("voice")
+
+# Upper bound on a single sleep so wall-clock jumps (DST, NTP) are picked up.
+_MAX_SLEEP = 3600.0
+# While a window is open its guild is swept again this often, so failed kicks and
+# members whose roles changed are caught like the old per-minute loop did
+REARM_INTERVAL = timedelta(minutes=1)
+
+def disconnect_windows(guild_config: GuildConfig | None) -> tuple[set[tuple[int, int]], set[int]]:
+    """Returns the (start, end) minutes of the day of every disconnect window that can
+    apply in a guild, and the weekdays on which they can happen.
+
+    Every effective member config takes its start, grace and end from the server config
+    or one of the overrides, so pairing every known value with every other gives a
+    superset of the real windows. The sweep itself still checks is_dc_time."""
+    configs: list[QuietConfig] = [QuietConfig()] if guild_config is None else [
+        guild_config.server_config,
+        *guild_config.overrides.roles.values(),
+        *guild_config.overrides.users.values(),
+    ]
+    server = configs[0]
+    starts = {30 if server.start is None else server.start}
+    ends = {420 if server.end is None else server.end}
+    graces = {30 if server.grace is None else server.grace}
+    day_mask = 0
+    for config in configs:
+        if config.start is not None:
+            starts.add(config.start)
+        if config.end is not None:
+            ends.add(config.end)
+        if config.grace is not None:
+            graces.add(config.grace)
+        if config.days is not None:
+            day_mask |= config.days
+    days = {i for i in range(7) if day_mask >> i & 1}
+    return {((start + grace) % 1440, end) for start in starts for grace in graces for end in ends}, days
+
+def disconnect_minutes(guild_config: GuildConfig | None) -> tuple[set[int], set[int]]:
+    """Returns the minutes of the day at which a disconnect window can open in a guild,
+    and the weekdays on which it can happen. A window that wraps past midnight covers the
+    start of its own day too, which opens at 00:00 when the day before wasn't enabled."""
+    windows, days = disconnect_windows(guild_config)
+    minutes = {start for start, _ in windows}
+    if any(start > end for start, end in windows):
+        minutes.add(0)
+    return minutes, days
+
+def window_open(guild_config: GuildConfig | None, now: datetime) -> bool:
+    """Whether any disconnect window of the guild can be open at `now`"""
+    windows, days = disconnect_windows(guild_config)
+    if now.weekday() not in days:
+        return False
+    minute = now.hour * 60 + now.minute
+    return any(start <= minute <= end if start <= end else minute >= start or minute <= end
+               for start, end in windows)
+
+def next_disconnect(guild_config: GuildConfig | None, after: datetime) -> datetime | None:
+    """Returns the first disconnect transition strictly after `after`, or None if there is none"""
+    minutes, days = disconnect_minutes(guild_config)
+    if not minutes or not days:
+        return None
+    ordered = sorted(minutes)
+    midnight = datetime.combine(after.date(), datetime.min.time())
+    for offset in range(8):
+        day = midnight + timedelta(days=offset)
+        if day.weekday() not in days:
+            continue
+        for minute in ordered:
+            when = day + timedelta(minutes=minute)
+            if when > after:
+                return when
+    return None
+
+class DisconnectScheduler:
+    """Sleeps until the next disconnect transition of any guild and only then runs the
+    sweep for the guilds that are due, instead of polling every guild each minute."""
+
+    def __init__(self, on_due: Callable[[int], Awaitable[None]]):
+        self._on_due = on_due
+        self._heap: list[tuple[datetime, int]] = []
+        self._due: dict[int, datetime] = {} # Current transition per guild, heap entries that don't match are stale
+        self._guilds: set[int] = set()
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> dict[int, datetime]:
+        return dict(self._due)
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._wake = asyncio.Event()
+        add_change_listener(self.reschedule)
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        remove_change_listener(self.reschedule)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def add_guild(self, guild_id: int) -> None:
+        self._guilds.add(guild_id)
+        self._push(guild_id, datetime.now())
+
+    def remove_guild(self, guild_id: int) -> None:
+        self._guilds.discard(guild_id)
+        self._due.pop(guild_id, None)
+
+    def reschedule(self, guild_id: int | None) -> None:
+        """Config change listener. The affected guilds are evaluated right away, in case the
+        change opened a window that is already running, and then follow their new schedule."""
+        now = datetime.now()
+        for gid in (self._guilds if guild_id is None else {guild_id} & self._guilds):
+            self._push(gid, now)
+
+    def _push(self, guild_id: int, when: datetime | None) -> None:
+        if when is None:
+            self._due.pop(guild_id, None)
+            return
+        self._due[guild_id] = when
+        heapq.heappush(self._heap, (when, guild_id))
+        if self._wake is not None:
+            self._wake.set()
+
+    def _schedule_next(self, guild_id: int, after: datetime) -> None:
+        guild_config = load_root().get_guild(guild_id)
+        when = next_disconnect(guild_config, after)
+        if window_open(guild_config, after):
+            rearm = after + REARM_INTERVAL
+            when = rearm if when is None else min(when, rearm)
+        self._push(guild_id, when)
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+
+            delay = (self._heap[0][0] - datetime.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=min(delay, _MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            when, guild_id = heapq.heappop(self._heap)
+            del self._due[guild_id]
+            self._schedule_next(guild_id, max(when, datetime.now()))
+            task = asyncio.create_task(self._fire(guild_id))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _fire(self, guild_id: int) -> None:
+        try:
+            await self._on_due(guild_id)
+        except Exception:
+            log.exception("Disconnect sweep failed for guild %s", guild_id)
@@ -0,0 +1,92 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+class BatchWriter(Generic[T]):
+    """Writes queued items in batches on a single background thread, so the event loop
+    never waits on the disk.
+
+    add() queues an item and the thread picks up everything queued `delay` seconds
+    later in one call to `write`. If `write` raises, the batch goes back to the front of
+    the queue and is retried after `retry_delay`; `write` has to leave whatever it owns
+    in a state it can retry from."""
+
+    def __init__(self, write: Callable[[list[T]], None], *, name: str, log: logging.Logger, what: str,
+                 delay: float, retry_delay: float):
+        self._write = write
+        self.log = log
+        self.what = what # Names the items in log lines, e.g. "config changes"
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending: list[T] = []
+        self._scheduled = False
+        self._busy = False
+        self._flushing = threading.Event() # Cuts the batching wait short
+
+    @property
+    def busy(self) -> bool:
+        """Whether anything is queued, scheduled or being written"""
+        with self._lock:
+            return self._busy
+
+    def add(self, item: T) -> None:
+        with self._lock:
+            self._pending.append(item)
+            self._busy = True
+            if not self._scheduled:
+                self._schedule(None)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Runs fn(*args) on the writer thread"""
+        return self.executor.submit(fn, *args)
+
+    def flush(self) -> bool:
+        """Blocks until everything queued is written. Returns False if the write failed,
+        the items stay queued for the retry."""
+        self._flushing.set()
+        try:
+            return self.executor.submit(self.write_pending).result()
+        finally:
+            self._flushing.clear()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    # Everything below runs on the writer thread
+
+    def _schedule(self, delay: float | None) -> None:
+        # Called with _lock held
+        self._scheduled = True
+        self.executor.submit(self._drain, delay)
+
+    def _drain(self, delay: float | None) -> None:
+        # Let a burst of items pile up into one batch
+        self._flushing.wait(self.delay if delay is None else delay)
+        with self._lock:
+            self._scheduled = False
+        self.write_pending()
+
+    def write_pending(self) -> bool:
+        """Writes everything queued right away. Returns False if it had to be requeued."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        try:
+            if batch:
+                self._write(batch)
+            return True
+        except Exception:
+            self.log.exception("Failed to write %d %s, retrying in %gs", len(batch), self.what, self.retry_delay)
+            with self._lock:
+                self._pending[:0] = batch
+                if not self._scheduled:
+                    self._schedule(self.retry_delay)
+            return False
+        finally:
+            with self._lock:
+                if not self._pending and not self._scheduled:
+                    self._busy = False
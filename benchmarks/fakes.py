@@ -0,0 +1,243 @@
+"""Lightweight stand-ins for the discord.py objects the bot touches.
+
+They only carry the attributes and coroutines the bot actually uses, so the hot paths
+can run without a gateway connection or HTTP client. Their API coroutines go through
+the installed FakeAPI, if any, which records calls and can add latency and 429s."""
+import asyncio
+import random
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import count
+import discord
+
+_ids = count(10_000_000_000_000_000)
+
+def next_id() -> int:
+    return next(_ids)
+
+class RateLimited(discord.HTTPException):
+    """A 429 as discord.py raises it, without needing a real HTTP response"""
+
+    def __init__(self, retry_after: float):
+        Exception.__init__(self, f"429 Too Many Requests (retry after {retry_after}s)")
+        self.status = 429
+        self.code = 0
+        self.text = "You are being rate limited."
+        self.retry_after = retry_after
+
+class FakeAPI:
+    """Stand-in for the Discord HTTP API. Every request is counted by route and takes
+    `latency` +- `jitter` seconds. A `rate_limit` fraction of them get a 429, which is
+    handled like discord.py's HTTPClient does: wait `retry_after` and send the request
+    again. With `exhausted` set a 429 raises RateLimited instead, as when discord.py
+    runs out of retries or the wait is longer than it's willing to sleep."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_limit: float = 0.0,
+                 retry_after: float = 0.25, exhausted: bool = False, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.exhausted = exhausted
+        self.rng = random.Random(seed)
+        self.calls: Counter[str] = Counter()
+        self.rate_limited: Counter[str] = Counter()
+
+    async def call(self, route: str) -> None:
+        while True:
+            self.calls[route] += 1
+            delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not self.rate_limit or self.rng.random() >= self.rate_limit:
+                return
+            self.rate_limited[route] += 1
+            if self.exhausted:
+                raise RateLimited(self.retry_after)
+            await asyncio.sleep(self.retry_after)
+
+class _Response:
+    """What discord.HTTPException reads off an aiohttp response"""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+_api: FakeAPI | None = None
+
+def install_api(api: FakeAPI | None) -> None:
+    global _api
+    _api = api
+
+async def _call(route: str) -> None:
+    if _api is not None:
+        await _api.call(route)
+
+class FakeRole:
+    __slots__ = ("id", "name", "position")
+
+    def __init__(self, id: int, position: int = 0, name: str | None = None):
+        self.id = id
+        self.position = position
+        self.name = name or f"role-{id}"
+
+    def __str__(self) -> str:
+        return self.name
+
+class FakeVoiceState:
+    __slots__ = ("channel",)
+
+    def __init__(self, channel: "FakeVoiceChannel | None"):
+        self.channel = channel
+
+class FakeUser:
+    def __init__(self, id: int | None = None, name: str | None = None, bot: bool = False):
+        self.id = id or next_id()
+        self.name = name or f"user-{self.id}"
+        self.bot = bot
+        self.sent: list[str] = []
+
+    def __str__(self) -> str:
+        return self.name
+
+    def __eq__(self, other) -> bool:
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    async def send(self, content: str, **kwargs) -> None:
+        await _call("dm")
+        self.sent.append(content)
+
+class FakeMember(FakeUser):
+    def __init__(self, guild: "FakeGuild", id: int | None = None, roles: list[FakeRole] | None = None, **kwargs):
+        super().__init__(id, **kwargs)
+        self.guild = guild
+        self.roles = roles or []
+        self.voice: FakeVoiceState | None = None
+        self.moves = 0
+
+    async def move_to(self, channel, *, reason: str | None = None) -> None:
+        await _call("move_to")
+        self.moves += 1
+        if self.voice is not None and self.voice.channel is not None:
+            self.voice.channel.members.remove(self)
+        self.voice = None if channel is None else FakeVoiceState(channel)
+        if channel is not None:
+            channel.members.append(self)
+
+class FakeVoiceChannel:
+    def __init__(self, guild: "FakeGuild", id: int | None = None, name: str | None = None):
+        self.guild = guild
+        self.id = id or next_id()
+        self.name = name or f"voice-{self.id}"
+        self.members: list[FakeMember] = []
+
+    def __str__(self) -> str:
+        return self.name
+
+    def connect_member(self, member: FakeMember) -> None:
+        member.voice = FakeVoiceState(self)
+        self.members.append(member)
+
+class FakeTextChannel:
+    def __init__(self, guild: "FakeGuild", id: int | None = None, name: str | None = None):
+        self.guild = guild
+        self.id = id or next_id()
+        self.name = name or f"text-{self.id}"
+        self.sent: list[str] = []
+        self.deleted: list[int] = []
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def send(self, content: str, **kwargs) -> None:
+        await _call("send")
+        self.sent.append(content)
+
+    async def delete_messages(self, messages, **kwargs) -> None:
+        await _call("bulk_delete")
+        self.deleted.extend(m.id for m in messages)
+
+class FakeGuild:
+    def __init__(self, id: int | None = None, name: str | None = None):
+        self.id = id or next_id()
+        self.name = name or f"guild-{self.id}"
+        self.shard_id = 0
+        self.roles: list[FakeRole] = []
+        self.members: dict[int, FakeMember] = {}
+        self.voice_channels: list[FakeVoiceChannel] = []
+        self.text_channels: list[FakeTextChannel] = []
+
+    def __str__(self) -> str:
+        return self.name
+
+    def get_member(self, member_id: int) -> FakeMember | None:
+        return self.members.get(member_id)
+
+    def get_role(self, role_id: int) -> FakeRole | None:
+        return next((r for r in self.roles if r.id == role_id), None)
+
+    def add_member(self, member: FakeMember) -> FakeMember:
+        self.members[member.id] = member
+        return member
+
+    async def fetch_member(self, member_id: int) -> FakeMember:
+        await _call("fetch_member")
+        member = self.members.get(member_id)
+        if member is None:
+            raise discord.NotFound(_Response(404, "Not Found"), "Unknown Member") # type: ignore[arg-type]
+        return member
+
+class FakeMessage:
+    def __init__(self, author: FakeMember, channel: FakeTextChannel, content: str):
+        self.id = next_id()
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.created_at = datetime.now(timezone.utc)
+        self.deleted = False
+
+    async def delete(self, **kwargs) -> None:
+        await _call("delete")
+        self.deleted = True
+        self.channel.deleted.append(self.id)
+
+class FakeContext:
+    def __init__(self, message: FakeMessage, command=None):
+        self.message = message
+        self.guild = message.guild
+        self.command = command
+
+    @property
+    def valid(self) -> bool:
+        return self.command is not None
+
+class FakeBot:
+    """Enough of commands.Bot for the message pipeline and the disconnect sweep"""
+
+    def __init__(self, guilds: list[FakeGuild] | None = None, prefix: str = "$"):
+        self.user = FakeUser(name="DadBot", bot=True)
+        self.prefix = prefix
+        self.guilds = guilds or []
+        self.shard_count: int | None = None
+        self.invoked = 0
+
+    def get_guild(self, guild_id: int) -> FakeGuild | None:
+        for guild in self.guilds:
+            if guild.id == guild_id:
+                return guild
+        return None
+
+    async def get_prefix(self, message) -> str:
+        return self.prefix
+
+    async def get_context(self, message) -> FakeContext:
+        word = message.content[len(self.prefix):].split(" ", 1)[0]
+        return FakeContext(message, command=word or None)
+
+    async def invoke(self, ctx: FakeContext) -> None:
+        if ctx.command is not None:
+            self.invoked += 1
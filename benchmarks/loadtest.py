@@ -0,0 +1,249 @@
+"""Replays a stream of gateway events into the real cogs against a fake HTTP API.
+
+    python -m benchmarks.loadtest                                  # 1 AM in a 100k-member guild
+    python -m benchmarks.loadtest --record events.jsonl --duration 60
+    python -m benchmarks.loadtest --replay events.jsonl --latency 0.05 --rate-limit 0.02 --out load.json
+
+MESSAGE_CREATE events go through the message pipeline with the quiet time and joke
+stages, TYPING_START through Parental.on_typing and VOICE_STATE_UPDATE through the
+same handler main.py installs. A disconnect sweep runs at the start, as it would at
+cutoff. Reports end-to-end latency percentiles per event type (from when the event was
+due to when its handler returned), event loop lag, and outbound API calls per event."""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from DadBot import config_manager
+from DadBot.config_store import JsonConfigStore
+from DadBot.disconnect import DisconnectExecutor
+from DadBot.main import end_call, handle_voice_state
+from DadBot.pipeline import MessagePipeline
+from DadBot.presence import VoicePresence
+from DadBot.cogs.parental import Parental
+from DadBot.cogs.jokes import Jokes
+from .fakes import FakeAPI, FakeBot, FakeMember, FakeMessage, FakeVoiceState, install_api
+from .synthetic import always_quiet, make_guild
+
+MESSAGE, TYPING, VOICE = "MESSAGE_CREATE", "TYPING_START", "VOICE_STATE_UPDATE"
+TEXTS = ["hello there", "I'm tired", "anyone up?", "gg", "i am hungry", "lol", "one more game", "$parental"]
+
+Event = dict[str, object]
+
+def synthesize(args: argparse.Namespace, voice_channels: int, text_channels: int) -> list[Event]:
+    """Poisson arrivals at --rate for --duration seconds. Most events come from a small
+    set of active members, like a late-night server."""
+    rng = random.Random(args.seed)
+    mix = {MESSAGE: args.messages, TYPING: args.typing, VOICE: args.voice}
+    kinds, weights = list(mix), list(mix.values())
+    active = max(1, args.members // 20)
+    events: list[Event] = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(args.rate)
+        if t >= args.duration:
+            return events
+        kind = rng.choices(kinds, weights)[0]
+        user = rng.randrange(active) if rng.random() < 0.8 else rng.randrange(args.members)
+        event: Event = {"t": round(t, 6), "type": kind, "user": user}
+        if kind == MESSAGE:
+            event["channel"] = rng.randrange(text_channels)
+            event["content"] = rng.choice(TEXTS)
+        elif kind == TYPING:
+            event["channel"] = rng.randrange(text_channels)
+        else:
+            event["channel"] = None if rng.random() < 0.3 else rng.randrange(voice_channels)
+        events.append(event)
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p90_ms": round(pick(0.90) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+async def _monitor_lag(samples: list[float], interval: float, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+class _Now:
+    """The `when` argument of on_typing, only ctime() is used"""
+    def ctime(self) -> str:
+        return time.ctime()
+
+async def run(args: argparse.Namespace) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="dadbot-load-"))
+    config_manager.use_store(JsonConfigStore(workdir / "config.json"))
+    root = config_manager.load_root()
+    guild_id = 1
+    if args.quiet:
+        always_quiet(root.ensure_guild(guild_id))
+    config_manager.save_root(root)
+
+    print(f"Building a guild with {args.members} members, {args.in_voice} in voice...", flush=True)
+    guild = make_guild(guild_id, members=args.members, in_voice=args.in_voice, voice_channels=args.voice_channels, seed=args.seed)
+    members: list[FakeMember] = list(guild.members.values())
+    bot = FakeBot([guild])
+
+    if args.replay:
+        with args.replay.open(encoding="utf-8") as file:
+            events = [json.loads(line) for line in file if line.strip()]
+    else:
+        events = synthesize(args, len(guild.voice_channels), len(guild.text_channels))
+    if args.record:
+        with args.record.open("w", encoding="utf-8") as file:
+            file.writelines(json.dumps(e) + "\n" for e in events)
+        print(f"Recorded {len(events)} events to {args.record}")
+
+    api = FakeAPI(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                  exhausted=args.rate_limit_exhausted, seed=args.seed)
+    install_api(api)
+
+    parental = Parental(bot)  # type: ignore[arg-type]
+    parental.cooldowns_for(guild).path = None  # type: ignore[arg-type]
+    parental.outbox.start()
+    jokes = Jokes(bot)  # type: ignore[arg-type]
+    pipeline = MessagePipeline(bot)  # type: ignore[arg-type]
+    pipeline.add_stage("quiet_time", parental.enforce_quiet_time, order=100)
+    pipeline.add_stage("jokes", jokes.tell_joke, order=200)
+    presence = VoicePresence()
+    presence.rebuild_guild(guild)  # type: ignore[arg-type]
+    disconnects = DisconnectExecutor()
+    disconnects.start()
+
+    latencies: dict[str, list[float]] = {MESSAGE: [], TYPING: [], VOICE: []}
+    handler_times: dict[str, list[float]] = {MESSAGE: [], TYPING: [], VOICE: []}
+    failures: Counter[str] = Counter()
+
+    async def handle(event: Event, due: float) -> None:
+        kind = str(event["type"])
+        member = members[int(event["user"]) % len(members)]  # type: ignore[arg-type]
+        started = time.perf_counter()
+        try:
+            if kind == MESSAGE:
+                channel = guild.text_channels[int(event["channel"])]  # type: ignore[arg-type]
+                await pipeline.dispatch(FakeMessage(member, channel, str(event.get("content", ""))))  # type: ignore[arg-type]
+            elif kind == TYPING:
+                channel = guild.text_channels[int(event["channel"])]  # type: ignore[arg-type]
+                await parental.on_typing(channel, member, _Now())
+            else:
+                before = FakeVoiceState(member.voice.channel if member.voice else None)
+                target = None if event["channel"] is None else guild.voice_channels[int(event["channel"])]  # type: ignore[arg-type]
+                if before.channel is not None:
+                    before.channel.members.remove(member)
+                member.voice = None
+                if target is not None:
+                    target.connect_member(member)
+                await handle_voice_state(presence, disconnects, member, before, FakeVoiceState(target))  # type: ignore[arg-type]
+        except Exception as e:
+            failures[f"{kind}:{type(e).__name__}"] += 1
+        finished = time.perf_counter()
+        handler_times[kind].append(finished - started)
+        latencies[kind].append(finished - due)
+
+    lag: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_lag(lag, 0.005, stop))
+    running: set[asyncio.Task] = set()
+
+    print(f"Replaying {len(events)} events over {events[-1]['t'] if events else 0:.1f}s...", flush=True)
+    start = time.perf_counter()
+    sweep = asyncio.create_task(end_call(bot, disconnects, presence, guild_id))  # type: ignore[arg-type]
+    for event in events:
+        due = start + float(event["t"]) / args.speed  # type: ignore[arg-type]
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(handle(event, due))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    if running:
+        await asyncio.gather(*running)
+    replayed = time.perf_counter() - start
+    sweep_stats = await sweep
+
+    # Let the background work (deletions, DMs, disconnects) finish
+    await parental.deletions.flush()
+    deadline = time.perf_counter() + args.drain
+    while len(parental.outbox) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    stop.set()
+    await monitor
+    await parental.outbox.stop()
+    await disconnects.stop()
+    install_api(None)
+    config_manager.flush()
+
+    total_calls = sum(api.calls.values())
+    return {
+        "events": len(events),
+        "replay_seconds": round(replayed, 3),
+        "events_per_sec": round(len(events) / replayed, 1) if replayed else 0.0,
+        "latency": {kind: percentiles(samples) for kind, samples in latencies.items()},
+        "handler": {kind: percentiles(samples) for kind, samples in handler_times.items()},
+        "loop_lag": percentiles(lag),
+        "api_calls": dict(api.calls),
+        "api_rate_limited": dict(api.rate_limited),
+        "api_calls_per_event": round(total_calls / len(events), 4) if events else 0.0,
+        "sweep": str(sweep_stats) if sweep_stats else None,
+        "dm_outbox_backlog": len(parental.outbox),
+        "failures": dict(failures),
+    }
+
+def report(results: dict) -> None:
+    print(f"\n{results['events']} events in {results['replay_seconds']}s ({results['events_per_sec']}/s)")
+    print(f"{'':<20} {'count':>8} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    rows = [(f"e2e {k}", v) for k, v in results["latency"].items()] + [("loop lag", results["loop_lag"])]
+    for name, p in rows:
+        if p["count"]:
+            print(f"{name[:20]:<20} {p['count']:>8} {p['p50_ms']:>10.2f} {p['p90_ms']:>10.2f} {p['p99_ms']:>10.2f} {p['max_ms']:>10.2f}")
+    print(f"API calls: {results['api_calls']} ({results['api_calls_per_event']} per event), 429s: {results['api_rate_limited']}")
+    print(f"Sweep: {results['sweep']}")
+    if results["failures"]:
+        print(f"Handler failures: {results['failures']}")
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=100_000)
+    parser.add_argument("--in-voice", type=int, default=2_000)
+    parser.add_argument("--voice-channels", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=300.0, help="events per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of synthetic events")
+    parser.add_argument("--messages", type=float, default=0.6, help="share of MESSAGE_CREATE events")
+    parser.add_argument("--typing", type=float, default=0.35, help="share of TYPING_START events")
+    parser.add_argument("--voice", type=float, default=0.05, help="share of VOICE_STATE_UPDATE events")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--no-quiet", dest="quiet", action="store_false", help="don't force quiet time")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of API calls answered with a 429")
+    parser.add_argument("--rate-limit-exhausted", action="store_true",
+                        help="raise on a 429 instead of waiting and retrying, like discord.py out of retries")
+    parser.add_argument("--drain", type=float, default=10.0, help="seconds to wait for background work afterwards")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--record", type=Path, help="write the event stream to this JSONL file")
+    parser.add_argument("--replay", type=Path, help="replay events from this JSONL file")
+    parser.add_argument("--out", type=Path, help="write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Offline benchmarks for the quiet-time hot paths.
+
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --compare bench.json --threshold 0.2
+
+Results are written as JSON. With --compare, each result is checked against the stored
+baseline, and the exit status is 1 if any of them got slower by more than --threshold."""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from DadBot import config_manager, logic
+from DadBot.config_store import JsonConfigStore
+from DadBot.disconnect import DisconnectExecutor
+from DadBot.main import end_call
+from DadBot.presence import VoicePresence
+from DadBot.pipeline import MessagePipeline
+from DadBot.cogs.parental import Parental
+from DadBot.cogs.jokes import Jokes
+from .fakes import FakeBot, FakeMessage
+from .synthetic import always_quiet, make_guild, make_root
+
+Results = dict[str, dict[str, float]]
+
+def _summary(samples: list[float], number: int) -> dict[str, float]:
+    per_op = [s / number * 1e6 for s in samples]
+    median = statistics.median(per_op)
+    return {
+        "per_op_us": round(median, 3),
+        "best_us": round(min(per_op), 3),
+        "ops_per_sec": round(1e6 / median, 1) if median else 0.0,
+        "number": number,
+    }
+
+def bench(fn: Callable[[], object], *, number: int, repeat: int) -> dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append(time.perf_counter() - started)
+    return _summary(samples, number)
+
+async def abench(fn: Callable[[], Awaitable[object]], *, number: int, repeat: int,
+                 setup: Callable[[], object] | None = None) -> dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        for _ in range(number):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            await fn()
+            elapsed += time.perf_counter() - started
+        samples.append(elapsed)
+    return _summary(samples, number)
+
+async def run(args: argparse.Namespace) -> Results:
+    results: Results = {}
+    rng = random.Random(args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="dadbot-bench-"))
+    store = JsonConfigStore(workdir / "config.json")
+    config_manager.use_store(store)
+
+    root = make_root(args.guilds, args.overrides, seed=args.seed)
+    quiet_guild_id = args.guilds + 1
+    always_quiet(root.ensure_guild(quiet_guild_id))
+    config_manager.save_root(root)
+    config_manager.flush()
+
+    def record(name: str, result: dict[str, float]) -> None:
+        if args.only and args.only not in name:
+            return
+        results[name] = result
+        print(f"{name:<32} {result['per_op_us']:>12.2f} us/op {result['ops_per_sec']:>14.1f} ops/s", flush=True)
+
+    n = args.number
+
+    # Config store
+    record("config.load_root.cached", bench(config_manager.load_root, number=n * 10, repeat=args.repeat))
+
+    def load_cold():
+        config_manager.invalidate_cache()
+        config_manager.load_root()
+    record("config.load_root.cold", bench(load_cold, number=max(1, n // 1000), repeat=args.repeat))
+
+    def save_flush():
+        config_manager.save_root(config_manager.load_root())
+        config_manager.flush()
+    record("config.save_root", bench(save_flush, number=max(1, n // 1000), repeat=args.repeat))
+
+    guild_ids = [g.server_id for g in root.servers[:args.guilds]]
+    def set_override():
+        config_manager.set_user_override(rng.choice(guild_ids), rng.randrange(1 << 40), grace_period=15)
+    record("config.set_user_override", bench(set_override, number=max(1, n // 10), repeat=args.repeat))
+    config_manager.flush()
+
+    # Resolution and quiet-time checks
+    guilds = [make_guild(gid, members=args.members, in_voice=0, seed=gid) for gid in guild_ids[:20]]
+    members = [m for g in guilds for m in g.members.values()]
+    pick = lambda: members[rng.randrange(len(members))]
+
+    record("logic.resolve.warm", bench(lambda: (m := pick()) and logic.resolve_config_for_member(m.guild.id, member=m), number=n, repeat=args.repeat))
+
+    def resolve_cold():
+        m = pick()
+        logic._invalidate(m.guild.id)
+        logic.resolve_config_for_member(m.guild.id, member=m)
+    record("logic.resolve.cold", bench(resolve_cold, number=max(1, n // 10), repeat=args.repeat))
+    record("logic.is_quiet_time", bench(lambda: (m := pick()) and logic.is_quiet_time(m.guild.id, member=m), number=n, repeat=args.repeat))
+    record("logic.is_dc_time", bench(lambda: (m := pick()) and logic.is_dc_time(m.guild.id, member=m), number=n, repeat=args.repeat))
+
+    # One full disconnect sweep of a guild
+    quiet_guild = make_guild(quiet_guild_id, members=args.members, in_voice=args.in_voice, seed=args.seed)
+    voice_members = [m for vc in quiet_guild.voice_channels for m in vc.members]
+    bot = FakeBot([quiet_guild])
+    disconnects = DisconnectExecutor()
+    presence = VoicePresence()
+
+    def reconnect():
+        for m in voice_members:
+            if m.voice is None:
+                rng.choice(quiet_guild.voice_channels).connect_member(m)
+        presence.rebuild_guild(quiet_guild)  # type: ignore[arg-type]
+    record("sweep.end_call", await abench(lambda: end_call(bot, disconnects, presence, quiet_guild_id),  # type: ignore[arg-type]
+                                          number=max(1, n // 1000), repeat=args.repeat, setup=reconnect))
+    await disconnects.stop()
+
+    # Per-message throughput through the pipeline stages
+    parental = Parental(bot)  # type: ignore[arg-type]
+    parental.cooldowns_for(quiet_guild).path = None  # type: ignore[arg-type]
+    jokes = Jokes(bot)  # type: ignore[arg-type]
+    channel = quiet_guild.text_channels[0]
+    texts = ["hello there", "I'm tired", "anyone up?", "$parental", "i am hungry", "lol"]
+    quiet_members = list(quiet_guild.members.values())
+    message = lambda: FakeMessage(rng.choice(quiet_members), channel, rng.choice(texts))
+
+    for name, stages in (("messages.parental", [("quiet_time", parental.enforce_quiet_time, 100)]),
+                         ("messages.jokes", [("jokes", jokes.tell_joke, 200)]),
+                         ("messages.pipeline", [("quiet_time", parental.enforce_quiet_time, 100),
+                                                ("jokes", jokes.tell_joke, 200)])):
+        pipeline = MessagePipeline(bot)  # type: ignore[arg-type]
+        for stage_name, stage, order in stages:
+            pipeline.add_stage(stage_name, stage, order=order)
+        record(name, await abench(lambda: pipeline.dispatch(message()), number=n, repeat=args.repeat))  # type: ignore[arg-type]
+
+    config_manager.flush()
+    return results
+
+def compare(results: Results, baseline: Results, threshold: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or not base.get("per_op_us"):
+            continue
+        ratio = result["per_op_us"] / base["per_op_us"]
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{name:<32} {base['per_op_us']:>12.2f} -> {result['per_op_us']:>12.2f} us/op  x{ratio:5.2f} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--overrides", type=int, default=10_000)
+    parser.add_argument("--members", type=int, default=1000, help="members per synthetic guild")
+    parser.add_argument("--in-voice", type=int, default=200, help="members in voice for the sweep")
+    parser.add_argument("--number", type=int, default=10_000, help="iterations per measurement")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help="only run benchmarks whose name contains this")
+    parser.add_argument("--out", type=Path, help="write results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    payload = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: str(v) for k, v in vars(args).items()},
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+    if args.out:
+        args.out.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
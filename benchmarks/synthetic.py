@@ -0,0 +1,62 @@
+"""Synthetic configs and guild populations at production-like scale"""
+import random
+from datetime import time
+from DadBot.config_models import RootConfig, GuildConfig, QuietConfig
+from .fakes import FakeGuild, FakeMember, FakeRole, FakeTextChannel, FakeVoiceChannel
+
+DAY_SETS = ["MTWRF", "MTWRFSU", "SU", "MTWR", "FS"]
+
+def _random_override(rng: random.Random) -> QuietConfig:
+    q = QuietConfig(start_time=None, end_time=None, grace_period=None, quiet_days=None)
+    if rng.random() < 0.6:
+        q.start_time = time(rng.choice([21, 22, 23, 0, 1]), rng.choice([0, 15, 30, 45]))
+    if rng.random() < 0.5:
+        q.end_time = time(rng.choice([5, 6, 7, 8]), rng.choice([0, 30]))
+    if rng.random() < 0.3:
+        q.grace_period = rng.choice([0, 10, 15, 30, 60])
+    if rng.random() < 0.3:
+        q.quiet_days = rng.choice(DAY_SETS)
+    return q
+
+def make_root(guilds: int = 1000, overrides: int = 10_000, roles_per_guild: int = 20, seed: int = 1) -> RootConfig:
+    """A config with `guilds` guilds and `overrides` role/user overrides spread across them.
+
+    Role ids are `guild_id * 1000 + n` for n < roles_per_guild, user ids are
+    `guild_id * 1_000_000 + n`, so populations built by make_guild line up with it."""
+    rng = random.Random(seed)
+    root = RootConfig()
+    for g in range(1, guilds + 1):
+        guild = root.ensure_guild(g)
+        guild.server_config = QuietConfig(
+            start_time=time(rng.choice([22, 23, 0]), rng.choice([0, 30])),
+            end_time=time(rng.choice([6, 7]), 0),
+            quiet_days=rng.choice(DAY_SETS),
+            grace_period=rng.choice([15, 30, 45]),
+        )
+    for _ in range(overrides):
+        guild = root.servers[rng.randrange(guilds)]
+        if rng.random() < 0.5:
+            guild.overrides.roles[guild.server_id * 1000 + rng.randrange(roles_per_guild)] = _random_override(rng)
+        else:
+            guild.overrides.users[guild.server_id * 1_000_000 + rng.randrange(500)] = _random_override(rng)
+    return root
+
+def always_quiet(guild: GuildConfig) -> None:
+    """Makes every check in the guild land inside quiet and disconnect time"""
+    guild.server_config = QuietConfig(start_time=time(0, 0), end_time=time(23, 59), quiet_days="MTWRFSU", grace_period=0)
+    guild.overrides.roles.clear()
+    guild.overrides.users.clear()
+
+def make_guild(guild_id: int, members: int = 1000, roles_per_guild: int = 20, in_voice: int = 200,
+               voice_channels: int = 10, seed: int = 1) -> FakeGuild:
+    rng = random.Random(seed)
+    guild = FakeGuild(id=guild_id)
+    guild.roles = [FakeRole(guild_id * 1000 + n, position=n) for n in range(roles_per_guild)]
+    guild.voice_channels = [FakeVoiceChannel(guild) for _ in range(voice_channels)]
+    guild.text_channels = [FakeTextChannel(guild) for _ in range(3)]
+    for n in range(members):
+        roles = rng.sample(guild.roles, rng.randrange(0, min(6, roles_per_guild) + 1))
+        member = guild.add_member(FakeMember(guild, id=guild_id * 1_000_000 + n, roles=roles))
+        if n < in_voice:
+            rng.choice(guild.voice_channels).connect_member(member)
+    return guild